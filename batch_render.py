@@ -0,0 +1,344 @@
+"""
+Batch rendering of nested box plots for many input files.
+
+Command line call:
+python batch_render.py "data/*.csv" -o output
+python batch_render.py --manifest jobs.txt -o output -j 8 -f pdf --set scatter_size=10
+python batch_render.py "data/*.csv" -o output --profile
+python batch_render.py "data/*.csv" -o output -f png,tiff,pdf
+
+Inputs are glob patterns and/or a manifest file listing one input per
+line, optionally followed by a tab and the output file name ("#" starts
+a comment). Other outputs are named after their input, keeping its
+path relative to the directory shared by the inputs (e1/data.csv and
+e2/data.csv give output/e1/data.png and output/e2/data.png); two jobs
+writing the same output are refused.
+
+Each input is rendered by nested_box_plots.startRender in a pool of
+worker processes using the headless Agg backend; each worker draws one
+figure at a time, and keeps it as a template for later jobs with the
+same box layout and configuration. With a list of formats, the files
+of a job are encoded and written by background threads of its worker
+while the next job is prepared. A failing job is reported and does
+not stop the others, nor does a job whose worker process dies (killed
+for lack of memory, crashed); the exit status is 1 if any job failed.
+With --profile, every plot gets a <plot>_profile.json trace of its
+stages (see profiling.py).
+"""
+
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from collections import OrderedDict, deque
+
+
+# Figure templates of this worker process, reused by jobs sharing a layout
+# (the max_templates most recently used are kept)
+TEMPLATES = OrderedDict()
+
+# Exporter of this worker process for lists of formats (see output.Exporter)
+EXPORTER = None
+
+# Most jobs sent to a worker at once when saving lists of formats: the
+# files of a job are then encoded while the next one is prepared
+EXPORT_CHUNK = 4
+
+
+def useAgg():
+
+    """
+    Subroutine for selecting the headless Agg backend before pyplot is
+    first imported; deferred so that parsing arguments stays fast
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def readManifest(path):
+
+    """
+    Subroutine for reading (input, output or None) pairs from a manifest file
+    """
+    jobs = []
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as manifest:
+        for line in manifest:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            fields = [f.strip() for f in line.split("\t")]
+            infile = os.path.join(base, fields[0])
+            jobs.append((infile, fields[1] if len(fields) > 1 and fields[1] else None))
+    return jobs
+
+
+def parseOverrides(items):
+
+    """
+    Subroutine for turning key=value strings into configurable overrides;
+    values are read as JSON when possible and kept as strings otherwise
+    """
+    overrides = {}
+    for item in items or []:
+        key, _, value = item.partition("=")
+        try:
+            overrides[key] = json.loads(value)
+        except ValueError:
+            overrides[key] = value
+    if "figsize" in overrides:
+        overrides["figsize"] = tuple(overrides["figsize"])
+    return overrides
+
+
+def commonDir(paths):
+
+    """
+    Subroutine for the deepest directory containing all of the paths
+    """
+    parts = [os.path.dirname(os.path.abspath(path)).split(os.sep) for path in paths]
+    common = parts[0] if parts else []
+    for part in parts[1:]:
+        n = 0
+        while n < min(len(common), len(part)) and common[n] == part[n]:
+            n += 1
+        common = common[:n]
+    return os.sep.join(common) or os.sep
+
+
+def collectJobs(patterns, manifest, output_dir, out_format):
+
+    """
+    Subroutine for the list of (input, output) jobs, in a stable order
+
+    Outputs not named by the manifest keep the path of their input
+    relative to the directory all such inputs share, so that inputs with
+    the same name in different directories (e1/data.csv, e2/data.csv)
+    get outputs of their own. Raises ValueError if two jobs still share
+    an output.
+    """
+    jobs = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            sys.stderr.write("warning: no input matches %s\n" % pattern)
+        jobs.extend((path, None) for path in matches)
+    if manifest:
+        jobs.extend(readManifest(manifest))
+
+    if isinstance(out_format, (list, tuple)):
+        out_format = out_format[0]
+    base = commonDir([infile for infile, outname in jobs if outname is None])
+    resolved = []
+    outputs = {}
+    for infile, outname in jobs:
+        if outname is None:
+            outname = os.path.splitext(os.path.relpath(os.path.abspath(infile), base))[0] + "." + out_format
+        outfile = os.path.normpath(os.path.join(output_dir, outname))
+        if outfile in outputs:
+            raise ValueError("%s and %s would both be rendered to %s" % (outputs[outfile], infile, outfile))
+        outputs[outfile] = infile
+        resolved.append((infile, outfile))
+    return resolved
+
+
+def startJob(job):
+
+    """
+    Subroutine for starting one job in a worker: returns (input, output,
+    start time, finishing function or None, traceback or None)
+    """
+    global EXPORTER
+    infile, outfile, overrides = job
+    start = time.time()
+    try:
+        useAgg()
+        from nested_box_plots import DEFAULT_CONFIG, startRender
+        # The output extension decides the format (manifests may name their
+        # own), unless a list of formats is saved next to it
+        if not isinstance(overrides.get("out_format"), (list, tuple)):
+            overrides = dict(overrides, out_format=os.path.splitext(outfile)[1].lstrip(".").lower())
+        elif EXPORTER is None:
+            from output import Exporter
+
+            EXPORTER = Exporter(overrides.get("export_threads", DEFAULT_CONFIG["export_threads"]))
+        finish = startRender(infile, outfile, templates=TEMPLATES, exporter=EXPORTER, **overrides)
+        return infile, outfile, start, finish, None
+    except Exception:
+        return infile, outfile, start, None, traceback.format_exc()
+
+
+def finishJob(started):
+
+    """
+    Subroutine for finishing a job of startJob: returns (input, output,
+    seconds, traceback or None)
+    """
+    infile, outfile, start, finish, error = started
+    if error is None:
+        try:
+            finish()
+        except Exception:
+            error = traceback.format_exc()
+    return infile, outfile, time.time() - start, error
+
+
+def renderJobs(jobs):
+
+    """
+    Render a chunk of jobs in a worker, one after the other, catching
+    any failure so that it is reported instead of taking down the pool.
+    Each job is finished (its files written) after the next one is
+    started, so that the files of a list of formats are encoded in the
+    background while the next figure is prepared. Returns one (input,
+    output, seconds, traceback or None) result per job.
+    """
+    results = []
+    previous = None
+    for job in jobs:
+        started = startJob(job)
+        if previous is not None:
+            results.append(finishJob(previous))
+        previous = started
+    if previous is not None:
+        results.append(finishJob(previous))
+    return results
+
+
+def poolJobs(queue, workers, report):
+
+    """
+    Subroutine for rendering the chunks of jobs of queue in one process
+    pool until the queue is empty or a worker dies; at most one chunk
+    per worker is running, so a dead worker loses few. Returns the
+    chunks lost with the pool.
+    """
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    from concurrent.futures.process import BrokenProcessPool
+
+    executor = ProcessPoolExecutor(workers)
+    running = {}
+    lost = []
+    broken = False
+    try:
+        while running or (queue and not broken):
+            while queue and len(running) < workers and not broken:
+                try:
+                    future = executor.submit(renderJobs, queue[0])
+                except BrokenProcessPool:
+                    broken = True
+                    break
+                running[future] = queue.popleft()
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = running.pop(future)
+                try:
+                    for result in future.result():
+                        report(result)
+                except BrokenProcessPool:
+                    broken = True
+                    lost.append(task)
+    finally:
+        executor.shutdown(wait=True)
+    return lost
+
+
+def renderBatch(jobs, overrides, workers=None, stream=sys.stderr):
+
+    """
+    Render all jobs in a process pool, reporting progress on stream.
+    Returns the list of (input, traceback) pairs of the failed jobs.
+
+    A worker that dies without raising (killed for lack of memory, a
+    crash in native code) breaks the pool along with the jobs running in
+    it. The pool is then restarted, and the jobs lost with it are run
+    again one at a time, so that only a job that kills its own worker is
+    reported as failed.
+
+    When a list of formats is saved, the jobs go to the workers in
+    chunks of up to EXPORT_CHUNK (see renderJobs).
+    """
+    failures = []
+    done = []
+
+    def report(result):
+        infile, outfile, elapsed, error = result
+        done.append(infile)
+        status = "ok" if error is None else "FAILED"
+        stream.write("[%d/%d] %s %s -> %s (%.1fs)\n" % (len(done), len(jobs), status, infile, outfile, elapsed))
+        if error is not None:
+            stream.write(error)
+            failures.append((infile, error))
+        stream.flush()
+
+    # The workers are not daemonic and could start pools of their own;
+    # the batch already keeps every core busy
+    overrides = dict(overrides)
+    if overrides.get("shard_workers") is None:
+        overrides["shard_workers"] = 1
+    tasks = [(infile, outfile, overrides) for infile, outfile in jobs]
+    workers = workers or multiprocessing.cpu_count()
+    size = 1
+    if isinstance(overrides.get("out_format"), (list, tuple)):
+        size = max(1, min(EXPORT_CHUNK, len(tasks) // workers))
+    queue = deque(tasks[n:n + size] for n in range(0, len(tasks), size))
+    while queue:
+        for chunk in poolJobs(queue, workers, report):
+            for task in chunk:
+                start = time.time()
+                if poolJobs(deque([[task]]), 1, report):
+                    report((task[0], task[1], time.time() - start,
+                            "the worker process died while rendering (killed or crashed)\n"))
+    return failures
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Render nested box plots for many input CSVs in parallel.")
+    parser.add_argument("inputs", nargs="*", help="input CSV files or glob patterns")
+    parser.add_argument("-m", "--manifest", help="file listing one input (and optionally a tab and its output name) per line")
+    parser.add_argument("-o", "--output-dir", default=".", help="directory for the rendered plots")
+    parser.add_argument("-f", "--format", default=None,
+                        help="output format, or comma-separated formats saved from one drawing; overrides out_format")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes (default: all cores)")
+    parser.add_argument("--profile", action="store_true",
+                        help="write a Chrome trace of the stages of every render next to its plot")
+    parser.add_argument("--set", dest="overrides", action="append", metavar="KEY=VALUE",
+                        help="override a configurable of nested_box_plots.DEFAULT_CONFIG (value as JSON)")
+    args = parser.parse_args(argv)
+
+    overrides = parseOverrides(args.overrides)
+    if args.format:
+        formats = args.format.split(",")
+        overrides["out_format"] = formats if len(formats) > 1 else formats[0]
+    if args.profile:
+        overrides["profile"] = True
+    from nested_box_plots import makeConfig
+    config = makeConfig(**overrides)
+    useAgg()
+
+    try:
+        jobs = collectJobs(args.inputs, args.manifest, args.output_dir, config["out_format"])
+    except ValueError as error:
+        parser.error(str(error))
+    if not jobs:
+        parser.error("no input files")
+    for directory in set(os.path.dirname(outfile) or "." for infile, outfile in jobs):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    start = time.time()
+    failures = renderBatch(jobs, overrides, workers=args.workers)
+    sys.stderr.write("%d of %d plots rendered in %.1fs\n" % (len(jobs) - len(failures), len(jobs), time.time() - start))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""
+Scaling benchmark of the nested box plot pipeline.
+
+For every dataset size, writes a synthetic CSV (see synthetic_data.py)
+and times each stage of the pipeline on it, recording wall time and
+the resident set size of the process: at the start and end of the
+stage, and its high-water mark during the stage (see profiling.py;
+this covers the buffers of the Agg canvas and the other native
+allocations that tracemalloc does not see):
+
+    read      pd.read_csv
+    grouping  grouping.groupData
+    stats     box_stats.treeStats
+    layout    layout.boxLayout
+    boxplot   box_artists.drawBoxes
+    scatter   scatter.drawScatter
+    save_<f>  output.savePlot for each output format f
+
+Command line call:
+python benchmarks/bench_stages.py --rows 10000 100000 1000000 -o bench.json
+python benchmarks/bench_stages.py --rows 10000 100000 --baseline bench.json
+
+Results are written as JSON (a list of {"rows", "stage", "seconds",
+"rss_start", "peak_rss", "rss_end", "peak_rss_delta", ...} records,
+the peaks being None where the high-water mark cannot be reset). With
+--baseline, every stage is compared with the same stage and size of a
+stored result file, and the exit status is 1 when one is slower than
+--tolerance times its baseline (plus --slack seconds).
+"""
+
+
+import matplotlib
+matplotlib.use("Agg")
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import matplotlib.pyplot as plt
+import pandas as pd
+
+from synthetic_data import writeDataset
+from nested_box_plots import makeConfig
+from grouping import groupData, iterBoxes
+from box_stats import treeStats
+from layout import boxLayout
+from scatter import drawScatter
+from output import savePlot
+from box_artists import boxSegments, drawBoxes
+from profiling import currentRss, peakRss, resetPeakRss
+
+
+class Stage(object):
+
+    """
+    Context manager timing one stage and recording the resident set size
+    it reached; memory is read before and after the timed span only, so
+    that measuring it does not slow the stage down
+    """
+
+    def __init__(self, results, rows, name, **extra):
+        self.results = results
+        self.record = dict(extra, rows=rows, stage=name)
+
+    def __enter__(self):
+        self.resettable = resetPeakRss()
+        self.record["rss_start"] = currentRss()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.record["seconds"] = time.time() - self.start
+        self.record["rss_end"] = currentRss()
+        peak = peakRss() if self.resettable else None
+        self.record["peak_rss"] = peak
+        self.record["peak_rss_delta"] = peak - self.record["rss_start"] if peak is not None else None
+        self.results.append(self.record)
+
+
+def benchSize(rows, args, workdir, results):
+
+    """
+    Run every stage on one synthetic dataset of the given size
+    """
+    config = makeConfig(dpi=args.dpi)
+    spec = config["spec"]
+    infile = writeDataset(os.path.join(workdir, "bench_%d.csv" % rows), rows, args.channels,
+                          args.genotypes, args.animals)
+    shape = {"channels": args.channels, "genotypes": args.genotypes, "animals": args.animals}
+
+    with Stage(results, rows, "read", **shape):
+        read_data = pd.read_csv(infile)
+    with Stage(results, rows, "grouping", **shape):
+        tree = groupData(read_data, spec=spec, dtype=args.value_dtype)
+    with Stage(results, rows, "stats", **shape):
+        stats = treeStats(tree, spec, whis=config["whis"])
+    with Stage(results, rows, "layout", **shape):
+        xidx, xtick_positions, vertical_lines_positions = boxLayout(tree, config)
+
+    boxes = [box for path, box in iterBoxes(tree)]
+    fig = plt.figure(figsize=config["figsize"])
+    ax = fig.add_subplot(111)
+    with Stage(results, rows, "boxplot", boxes=len(boxes), **shape):
+        segments = boxSegments(stats, xidx, [box["width"] for box in boxes], notch=config["notch"])
+        drawBoxes(ax, segments, [box["color"] for box in boxes], xidx)
+    with Stage(results, rows, "scatter", **shape):
+        drawScatter(ax, tree, xidx, spec, size=config["scatter_size"], alpha=config["transparency_of_scatter"],
+                    lod_threshold=args.lod_threshold)
+    for out_format in args.formats:
+        with Stage(results, rows, "save_" + out_format, dpi=args.dpi, **shape):
+            savePlot(fig, os.path.join(workdir, "bench.%s" % out_format), out_format, dpi=args.dpi)
+    plt.close(fig)
+    os.remove(infile)
+
+
+def compareBaseline(results, baseline, tolerance, slack=0.05, stream=sys.stdout):
+
+    """
+    Compare results with a baseline, stage by stage.
+    Returns the (rows, stage, ratio) records slower than tolerance times
+    the baseline plus slack seconds (which keeps millisecond stages from
+    flagging on timer noise).
+    """
+    reference = dict(((r["rows"], r["stage"]), r) for r in baseline)
+    regressions = []
+    stream.write("%10s  %-10s %10s %10s %7s\n" % ("rows", "stage", "seconds", "baseline", "ratio"))
+    for record in results:
+        base = reference.get((record["rows"], record["stage"]))
+        if base is None:
+            continue
+        ratio = record["seconds"] / max(base["seconds"], 1e-9)
+        flag = ""
+        if record["seconds"] > tolerance * base["seconds"] + slack:
+            regressions.append((record["rows"], record["stage"], ratio))
+            flag = "  <-- slower"
+        stream.write("%10d  %-10s %10.4f %10.4f %6.2fx%s\n" % (record["rows"], record["stage"], record["seconds"],
+                                                              base["seconds"], ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Benchmark the nested box plot pipeline on synthetic data.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--channels", type=int, default=3)
+    parser.add_argument("--genotypes", type=int, default=2)
+    parser.add_argument("--animals", type=int, default=4, help="animals per genotype")
+    parser.add_argument("--formats", nargs="+", default=["png", "pdf", "svg"])
+    parser.add_argument("--dpi", type=int, default=100)
+    parser.add_argument("--lod-threshold", type=int, default=None)
+    parser.add_argument("--value-dtype", default=None, help="storage type of the values, e.g. float32 or auto")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare with")
+    parser.add_argument("--tolerance", type=float, default=1.25,
+                        help="slowdown ratio above which a stage counts as a regression")
+    parser.add_argument("--slack", type=float, default=0.05,
+                        help="seconds a stage may exceed its tolerated time by before counting as a regression")
+    args = parser.parse_args(argv)
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix="nested_box_bench_")
+    try:
+        for rows in args.rows:
+            benchSize(rows, args, workdir, results)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for record in results:
+        delta = record["peak_rss_delta"]
+        sys.stdout.write("%10d  %-10s %10.4fs %10s MB\n" % (record["rows"], record["stage"], record["seconds"],
+                                                          "%.1f" % (delta / 1e6) if delta is not None else "-"))
+    if args.output:
+        with open(args.output, "w") as stream:
+            json.dump(results, stream, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as stream:
+            regressions = compareBaseline(results, json.load(stream), args.tolerance, args.slack)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
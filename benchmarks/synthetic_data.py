@@ -0,0 +1,80 @@
+"""
+Synthetic nested datasets for benchmarking.
+
+Generates CSVs with the same Channel/Animal/Geno/<value> schema as
+dataforHeather.csv, with a configurable number of rows, channels,
+genotypes and animals per genotype. Every animal has its own mean
+count, so the boxes differ the way real data does.
+
+Command line call:
+python benchmarks/synthetic_data.py out.csv --rows 1000000 --channels 3 --genotypes 2 --animals 4
+"""
+
+
+import argparse
+import sys
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+CHANNELS = ["VGLUT2", "GlyT2", "GAD67"]
+GENOTYPES = ["wt", "ko"]
+
+
+def levelNames(known, n, prefix):
+
+    """
+    Subroutine for n level values: the known names first, then numbered ones
+    """
+    return (known + ["%s%d" % (prefix, i) for i in range(len(known) + 1, n + 1)])[:n]
+
+
+def makeDataset(rows, channels=3, genotypes=2, animals=4, value_name="Count", seed=0):
+
+    """
+    Build a synthetic dataset as a DataFrame.
+
+    animals is the number of animals per genotype; animals are numbered
+    across genotypes and every animal is measured in every channel.
+    """
+    rng = np.random.RandomState(seed)
+    channel_names = np.array(levelNames(CHANNELS, channels, "CH"), dtype=object)
+    geno_names = np.array(levelNames(GENOTYPES, genotypes, "g"), dtype=object)
+
+    animal = rng.randint(0, genotypes * animals, rows)
+    channel = rng.randint(0, channels, rows)
+    means = rng.uniform(15., 45., (channels, genotypes * animals))
+    return pd.DataFrame(OrderedDict([("Channel", channel_names[channel]),
+                                     ("Animal", animal),
+                                     ("Geno", geno_names[animal // animals]),
+                                     (value_name, rng.poisson(means[channel, animal])),
+                                     ]))
+
+
+def writeDataset(path, rows, channels=3, genotypes=2, animals=4, seed=0):
+
+    """
+    Write a synthetic dataset to a CSV file, returning its path
+    """
+    makeDataset(rows, channels, genotypes, animals, seed=seed).to_csv(path, index=False)
+    return path
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Write a synthetic nested dataset.")
+    parser.add_argument("outfile")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--channels", type=int, default=3)
+    parser.add_argument("--genotypes", type=int, default=2)
+    parser.add_argument("--animals", type=int, default=4, help="animals per genotype")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    writeDataset(args.outfile, args.rows, args.channels, args.genotypes, args.animals, seed=args.seed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
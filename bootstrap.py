@@ -0,0 +1,194 @@
+"""
+Bootstrap confidence intervals for the medians of the nested box plots.
+
+The medians of all boxes are resampled at once. For a block of
+replicates, one matrix of random indices covers every box (each column
+draws, with replacement, from the sorted data of its own box); sorting
+the rows puts every box's resample in order, because the data of each
+box is sorted and the boxes occupy disjoint index ranges, so the
+median of every box in every replicate is read off at fixed columns.
+Blocks are sized to hold about max_cells indices, whatever the data
+size, and can be spread over a process pool (except in a daemonic
+process, such as a multiprocessing.Pool worker, which may not start
+processes of its own: there the blocks run in turn). Block k always
+draws from the random stream seeded by (seed, k), so the intervals do
+not depend on the number of workers.
+
+With hierarchical resampling, each replicate of an "All" box first
+draws its animals (the children of the box) with replacement, then
+the observations of every drawn animal, which accounts for the
+animal-to-animal variability that pooling the observations ignores.
+
+The percentile intervals replace the notch interval (cilo, cihi) of
+the box statistics, and are drawn as notches or error bars (see
+box_artists.py). Streamed trees (see streaming.py) only hold a sample
+of the data and keep their notch intervals.
+"""
+
+
+import multiprocessing
+
+import numpy as np
+
+from grouping import DEFAULT_SPEC, iterBoxes
+from box_stats import treeSegments
+
+
+# Replicates per block; fewer when the data is large (see blockSize)
+BLOCK = 256
+
+# Data of the worker processes, set once by the pool initializer
+WORKER_DATA = None
+
+
+def blockSize(total, max_cells=1 << 24):
+
+    """
+    Subroutine for the replicates per block, keeping a block near max_cells indices
+    """
+    return int(max(1, min(BLOCK, max_cells // max(total, 1))))
+
+
+def resampleMedians(values, starts, counts, n, rng):
+
+    """
+    Medians of n resamples of every sorted segment of values.
+    Returns an (n, segments) array.
+    """
+    if not len(counts):
+        return np.empty((n, 0))
+    column_start = np.repeat(starts, counts)
+    column_count = np.repeat(counts, counts)
+    index = column_start + (rng.random_sample((n, len(column_start))) * column_count).astype(np.int64)
+    index.sort(axis=1)
+    first = np.r_[0, np.cumsum(counts)[:-1]]
+    lo = index[:, first + (counts - 1) // 2]
+    hi = index[:, first + counts // 2]
+    return 0.5 * (values[lo] + values[hi])
+
+
+def hierarchicalMedians(values, starts, counts, ranks, merged, n, rng):
+
+    """
+    Medians of n two-stage resamples of the segments of values pooled
+    together: children drawn with replacement, then their observations.
+
+    ranks gives the position of every element of values in merged, the
+    sorted pool of all segments. Returns an (n,) array.
+    """
+    m = len(counts)
+    children = rng.randint(m, size=(n, m)).ravel()
+    sizes = counts[children]
+    pooled = sizes.reshape(n, m).sum(axis=1)
+
+    drawn = np.repeat(children, sizes)
+    position = starts[drawn] + (rng.random_sample(len(drawn)) * counts[drawn]).astype(np.int64)
+    # Sort each replicate by rank in the pool, replicates kept apart by their row
+    row = np.repeat(np.arange(n, dtype=np.int64), pooled)
+    keys = np.sort(row * len(merged) + ranks[position])
+
+    first = np.r_[0, np.cumsum(pooled)[:-1]]
+    lo = keys[first + (pooled - 1) // 2] % len(merged)
+    hi = keys[first + pooled // 2] % len(merged)
+    return 0.5 * (merged[lo] + merged[hi])
+
+
+def blockMedians(data, seed, block, n):
+
+    """
+    Subroutine for the medians of one block of n replicates; columns are
+    the plainly resampled segments, then the hierarchical pools
+    """
+    values, starts, counts, pools = data
+    rng = np.random.RandomState([seed, block])
+    medians = [resampleMedians(values, starts, counts, n, rng)]
+    for pool_values, pool_starts, pool_counts, ranks, merged in pools:
+        medians.append(hierarchicalMedians(pool_values, pool_starts, pool_counts, ranks, merged, n, rng)[:, None])
+    return np.hstack(medians)
+
+
+def setWorkerData(data):
+    global WORKER_DATA
+    WORKER_DATA = data
+
+
+def workerBlock(task):
+    return blockMedians(WORKER_DATA, *task)
+
+
+def bootstrapSegments(tree, spec=DEFAULT_SPEC, hierarchical=False):
+
+    """
+    Subroutine for the resampling data of a tree
+
+    Returns the box indices in the column order of blockMedians and the
+    data: (values, starts, counts) of the plainly resampled segments and
+    one (values, starts, counts, ranks, merged) pool per hierarchically
+    resampled "All" box.
+    """
+    boxes, (leaf_idx, leaf_values, leaf_offsets), (all_idx, all_values, all_offsets, all_runs) = \
+        treeSegments(tree, spec)
+    leaf_values = np.asarray(leaf_values, dtype=np.float64)
+    all_values = np.asarray(all_values, dtype=np.float64)
+
+    columns = list(leaf_idx) + list(all_idx)
+    pools = []
+    if hierarchical:
+        for n, runs in enumerate(all_runs):
+            pool_values = leaf_values[runs[0]:runs[-1]]
+            ranks = np.empty(len(pool_values), dtype=np.int64)
+            ranks[np.argsort(pool_values, kind="stable")] = np.arange(len(pool_values))
+            pools.append((pool_values, (runs[:-1] - runs[0]).astype(np.int64), np.diff(runs).astype(np.int64),
+                          ranks, all_values[all_offsets[n]:all_offsets[n + 1]]))
+        values, offsets = leaf_values, leaf_offsets
+    else:
+        values = np.concatenate([leaf_values, all_values])
+        offsets = np.r_[leaf_offsets[:-1], all_offsets + len(leaf_values)]
+    offsets = np.asarray(offsets, dtype=np.int64)
+    return columns, (values, offsets[:-1], np.diff(offsets), pools)
+
+
+def medianIntervals(tree, spec=DEFAULT_SPEC, n_boot=1000, level=0.95, hierarchical=False, seed=0,
+                    workers=1, max_cells=1 << 24):
+
+    """
+    Bootstrap percentile intervals of the median of every box of a grouped tree.
+    Returns (low, high) arrays in plotting order.
+    """
+    columns, data = bootstrapSegments(tree, spec, hierarchical)
+    values = data[0]
+    size = blockSize(len(values) * (2 if hierarchical else 1), max_cells)
+    tasks = [(seed, k, min(size, n_boot - start)) for k, start in enumerate(range(0, n_boot, size))]
+
+    if workers > 1 and len(tasks) > 1 and not multiprocessing.current_process().daemon:
+        pool = multiprocessing.Pool(min(workers, len(tasks)), initializer=setWorkerData, initargs=(data,))
+        try:
+            blocks = pool.map(workerBlock, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        blocks = [blockMedians(data, *task) for task in tasks]
+
+    medians = np.vstack(blocks)
+    low, high = np.percentile(medians, [50. * (1 - level), 100 - 50. * (1 - level)], axis=0)
+    order = np.argsort(columns)
+    return low[order], high[order]
+
+
+def bootstrapStats(tree, stats, spec=DEFAULT_SPEC, n_boot=1000, level=0.95, hierarchical=False, seed=0,
+                   workers=1):
+
+    """
+    Replace the notch intervals (cilo, cihi) of box statistics in
+    plotting order with bootstrap intervals of the medians.
+    Returns stats.
+    """
+    first = next(iterBoxes(tree), None)
+    if first is None or "sketch" in first[1]:
+        return stats
+    low, high = medianIntervals(tree, spec, n_boot=n_boot, level=level, hierarchical=hierarchical,
+                                seed=seed, workers=workers)
+    for s, lo, hi in zip(stats, low, high):
+        s["cilo"], s["cihi"] = lo, hi
+    return stats
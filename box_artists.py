@@ -0,0 +1,180 @@
+"""
+Box layer for the nested box plots.
+
+Draws all boxes as three artists instead of the six Line2D artists per
+box of Axes.boxplot/bxp: one LineCollection holding the box outlines,
+whiskers and caps, one holding the medians (drawn above, as by bxp),
+both with per-segment colour, width and style arrays, and one Line2D
+holding the fliers of all boxes. The median confidence intervals
+(cilo, cihi) can be added as one more LineCollection of error bars.
+The geometry, styling (boxplot.* rcParams) and drawing order are those
+of Axes.bxp, so the output looks the same; the number of artists no
+longer grows with the number of boxes, which is what dominates drawing
+and vector output at hundreds of boxes.
+"""
+
+
+from collections import OrderedDict
+
+import matplotlib as mpl
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba_array
+from matplotlib.lines import Line2D
+
+
+# Parts of a box and the boxplot.*props rcParams styling them
+BOX_PARTS = OrderedDict([("boxes", "box"), ("whiskers", "whisker"), ("caps", "cap"), ("medians", "median")])
+
+# Part of each segment of a box in the outline collection, in the order bxp draws them
+LINE_PARTS = ("boxes", "whiskers", "whiskers", "caps", "caps")
+
+
+def statsColumn(stats, key):
+
+    """
+    Subroutine for one statistic of every box as an array
+    """
+    return np.array([s[key] for s in stats], dtype=np.float64)
+
+
+def boxSegments(stats, positions, widths, notch=False):
+
+    """
+    Line coordinates of all boxes at once, laid out as by Axes.bxp
+
+    Returns a dict with, for every part of BOX_PARTS, an array of
+    segments (one (vertices, 2) polyline per box for "boxes", low then
+    high segment of every box for "whiskers" and "caps", one per box
+    for "medians"), the error bars of the median intervals under
+    "intervals" (bar, low cap and high cap of every box) and the x and
+    y coordinates of all fliers.
+    """
+    pos = np.asarray(positions, dtype=np.float64)
+    half = np.asarray(widths, dtype=np.float64) * 0.5
+    q1, med, q3 = statsColumn(stats, "q1"), statsColumn(stats, "med"), statsColumn(stats, "q3")
+    whislo, whishi = statsColumn(stats, "whislo"), statsColumn(stats, "whishi")
+    left, right = pos - half, pos + half
+    # Caps (and notches) are half as wide as the box
+    inner_left, inner_right = pos - half * 0.5, pos + half * 0.5
+
+    cilo, cihi = statsColumn(stats, "cilo"), statsColumn(stats, "cihi")
+    if notch:
+        box_x = [left, right, right, inner_right, right, right, left, left, inner_left, left, left]
+        box_y = [q1, q1, cilo, med, cihi, q3, q3, cihi, med, cilo, q1]
+        median_x = [inner_left, inner_right]
+    else:
+        box_x = [left, right, right, left, left]
+        box_y = [q1, q1, q3, q3, q1]
+        median_x = [left, right]
+
+    counts = [len(s["fliers"]) for s in stats]
+    return {"boxes": np.stack([np.column_stack(box_x), np.column_stack(box_y)], axis=-1),
+            "whiskers": np.stack([np.column_stack([pos, q1, pos, whislo]),
+                                  np.column_stack([pos, q3, pos, whishi])], axis=1).reshape(-1, 2, 2),
+            "caps": np.stack([np.column_stack([inner_left, whislo, inner_right, whislo]),
+                              np.column_stack([inner_left, whishi, inner_right, whishi])], axis=1).reshape(-1, 2, 2),
+            "medians": np.column_stack([median_x[0], med, median_x[1], med]).reshape(-1, 2, 2),
+            "intervals": np.stack([np.column_stack([pos, cilo, pos, cihi]),
+                                   np.column_stack([inner_left, cilo, inner_right, cilo]),
+                                   np.column_stack([inner_left, cihi, inner_right, cihi])], axis=1).reshape(-1, 2, 2),
+            "fliers": (np.repeat(pos, counts),
+                       np.concatenate([np.asarray(s["fliers"], dtype=np.float64) for s in stats] or [np.empty(0)])),
+            }
+
+
+def boxPoints(segments):
+
+    """
+    Subroutine for all line vertices of boxSegments, for the data limits
+    """
+    return np.concatenate([segments[part].reshape(-1, 2) for part in BOX_PARTS])
+
+
+def boxLines(segments):
+
+    """
+    Subroutine for the outline, whisker and cap segments of boxSegments,
+    box after box in the order of LINE_PARTS
+    """
+    boxes = segments["boxes"]
+    whiskers = segments["whiskers"].reshape(len(boxes), 2, 2, 2)
+    caps = segments["caps"].reshape(len(boxes), 2, 2, 2)
+    lines = []
+    for box, whisker, cap in zip(boxes, whiskers, caps):
+        lines.extend([box, whisker[0], whisker[1], cap[0], cap[1]])
+    return lines
+
+
+def lineCollection(segments, parts, rgba, capstyle=None):
+
+    """
+    Subroutine for a LineCollection of segments, each styled as its part
+    of BOX_PARTS (boxplot.*props rcParams) in its box colour
+    """
+    rc = mpl.rcParams
+    props = ["boxplot.%sprops." % BOX_PARTS[part] for part in parts]
+    repeat = len(parts)
+    return LineCollection(segments,
+                          colors=np.repeat(rgba, repeat, axis=0),
+                          linewidths=np.tile([rc[prop + "linewidth"] for prop in props], len(rgba)),
+                          linestyles=[rc[prop + "linestyle"] for prop in props] * len(rgba),
+                          capstyle=capstyle or rc["lines.solid_capstyle"], joinstyle=rc["lines.solid_joinstyle"],
+                          antialiaseds=rc["lines.antialiased"])
+
+
+def drawBoxes(ax, segments, colors, positions, intervals=False):
+
+    """
+    Draw the box layer of boxSegments onto ax; colors is one colour per
+    box and positions the x positions of the boxes.
+
+    Returns an OrderedDict of the artists: LineCollections under "lines"
+    (outlines, whiskers and caps), "medians" and, with intervals, under
+    "intervals" (error bars of the median intervals, twice as thick as
+    the medians), and a Line2D under "fliers". The collections do not
+    update the data limits of ax (see boxPoints).
+    """
+    rc = mpl.rcParams
+    rgba = to_rgba_array(colors)
+    artists = OrderedDict()
+    artists["lines"] = lineCollection(boxLines(segments), LINE_PARTS, rgba)
+    # Medians end flush with the box edges, as by bxp
+    artists["medians"] = lineCollection(segments["medians"], ("medians",), rgba, capstyle="butt")
+    # Medians are drawn over the boxes, as by bxp
+    artists["lines"].set_zorder(Line2D.zorder)
+    artists["medians"].set_zorder(Line2D.zorder + 0.1)
+    if intervals:
+        artists["intervals"] = lineCollection(segments["intervals"], ("medians",) * 3, rgba)
+        artists["intervals"].set_linewidths(2 * artists["intervals"].get_linewidths())
+        artists["intervals"].set_zorder(Line2D.zorder + 0.2)
+    for part in ("lines", "medians", "intervals"):
+        if part in artists:
+            ax.add_collection(artists[part], autolim=False)
+
+    flier_x, flier_y = segments["fliers"]
+    artists["fliers"] = ax.add_line(Line2D(flier_x, flier_y, linestyle=rc["boxplot.flierprops.linestyle"],
+                                           marker=rc["boxplot.flierprops.marker"],
+                                           markersize=rc["boxplot.flierprops.markersize"],
+                                           markerfacecolor=rc["boxplot.flierprops.markerfacecolor"],
+                                           markeredgecolor=rc["boxplot.flierprops.markeredgecolor"],
+                                           markeredgewidth=rc["boxplot.flierprops.markeredgewidth"],
+                                           zorder=Line2D.zorder))
+
+    # Keep autoscaling from adding margins beyond half a unit around the
+    # outer boxes, as bxp does
+    pos = np.asarray(positions, dtype=np.float64)
+    artists["medians"].sticky_edges.x[:] = np.column_stack([pos - 0.5, pos + 0.5]).ravel().tolist()
+    return artists
+
+
+def moveBoxes(artists, segments):
+
+    """
+    Move the artists of drawBoxes to new segments of boxSegments
+    """
+    artists["lines"].set_segments(boxLines(segments))
+    artists["medians"].set_segments(segments["medians"])
+    if "intervals" in artists:
+        artists["intervals"].set_segments(segments["intervals"])
+    artists["fliers"].set_data(*segments["fliers"])
@@ -0,0 +1,281 @@
+"""
+Box statistics for the nested box plots.
+
+Computes quartiles, whiskers, fliers and notches for every box of a
+grouped tree (see grouping.groupData) at once, and returns them in the
+list-of-dicts form accepted by matplotlib's Axes.bxp, so matplotlib
+does not have to recompute them box by box.
+
+All boxes are handled as segments of one flat array that is sorted
+within each segment. For a tree from grouping.columnsTree, that array
+is a view of the grouped value buffer itself, whatever its type. The
+"All" boxes are not re-sorted from scratch: their segments are built
+by merging the already sorted runs of their children.
+
+The trees of several value columns grouped together (see
+grouping.metricsData) go through the same pass as one set of segments.
+
+Trees built by streaming.streamData carry a quantile sketch per box
+instead of the full data; their statistics are approximate and each
+box reports the rank error bound of its sketch ("rank_error", which
+is 0 for exact statistics).
+"""
+
+
+from collections import OrderedDict
+
+import numpy as np
+
+from grouping import DEFAULT_SPEC, iterBoxes
+
+
+def segmentQuantile(values, starts, counts, q):
+
+    """
+    Subroutine for the q-th quantile of every sorted segment,
+    using the same linear interpolation as numpy.percentile
+    """
+    pos = starts + q * (counts - 1)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, starts + counts - 1)
+    frac = pos - lo
+    low = values[lo].astype(np.float64)
+    return low + frac * (values[hi] - low)
+
+
+def segmentStats(values, offsets, whis=1.5):
+
+    """
+    Compute box statistics for every segment of a flat array.
+
+    values holds the segments back to back, each sorted ascending, and
+    offsets holds the segment boundaries (length = number of segments + 1).
+    Every segment must be non-empty.
+
+    Returns a dict of per-segment arrays plus a list of flier arrays.
+    values can be of any numeric type; only the statistics are float64.
+    """
+    values = np.asarray(values)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts = offsets[:-1]
+    counts = np.diff(offsets)
+    segment = np.repeat(np.arange(len(counts)), counts)
+
+    q1 = segmentQuantile(values, starts, counts, 0.25)
+    med = segmentQuantile(values, starts, counts, 0.5)
+    q3 = segmentQuantile(values, starts, counts, 0.75)
+    iqr = q3 - q1
+
+    # Whiskers reach the most extreme data inside the fences; since each
+    # segment is sorted, counting the values below/above the fence gives
+    # their position directly
+    loval = q1 - whis * iqr
+    hival = q3 + whis * iqr
+    n_below = np.add.reduceat(values < loval[segment], starts)
+    n_inside = np.add.reduceat(values <= hival[segment], starts)
+    whislo = np.where(n_below < counts, values[np.minimum(starts + n_below, offsets[1:] - 1)].astype(np.float64), q1)
+    whishi = np.where(n_inside > 0, values[np.maximum(starts + n_inside - 1, starts)].astype(np.float64), q3)
+    whislo = np.minimum(whislo, q1)
+    whishi = np.maximum(whishi, q3)
+
+    outside = (values < whislo[segment]) | (values > whishi[segment])
+    fliers = np.split(values[outside].astype(np.float64), np.cumsum(np.bincount(segment[outside], minlength=len(counts)))[:-1])
+
+    notch = 1.57 * iqr / np.sqrt(counts)
+
+    return {"n": counts,
+            "rank_error": np.zeros(len(counts)),
+            "mean": np.add.reduceat(values, starts, dtype=np.float64) / counts,
+            "med": med,
+            "q1": q1,
+            "q3": q3,
+            "iqr": iqr,
+            "whislo": whislo,
+            "whishi": whishi,
+            "cilo": med - notch,
+            "cihi": med + notch,
+            "fliers": fliers,
+            }
+
+
+def joinViews(arrays):
+
+    """
+    Subroutine for joining 1-d arrays into one
+
+    Views of one buffer lying back to back in it, such as the boxes of
+    grouping.columnsTree, are joined into a view spanning them instead
+    of a copy.
+    """
+    if not arrays:
+        return np.empty(0)
+    first = arrays[0]
+    address = first.__array_interface__["data"][0]
+    for array in arrays:
+        if (array.base is None or array.base is not first.base or array.dtype != first.dtype
+                or not array.flags.c_contiguous or array.__array_interface__["data"][0] != address):
+            return np.concatenate(arrays)
+        address += array.nbytes
+    return np.lib.stride_tricks.as_strided(first, shape=(sum(len(a) for a in arrays),),
+                                           strides=(first.itemsize,), writeable=False)
+
+
+def treeSegments(tree, spec=DEFAULT_SPEC):
+
+    """
+    Subroutine for the data of every box of a grouped tree as sorted segments
+
+    Returns the (path, box) pairs in plotting order, the (box indices,
+    values, offsets) of the individual boxes and the (box indices,
+    values, offsets, runs) of the "All" boxes, where runs holds for
+    each "All" box the offsets of its children's segments in the
+    individual values.
+    """
+    boxes = list(iterBoxes(tree))
+
+    # Individual boxes, back to back
+    leaf_idx = [n for n, (path, box) in enumerate(boxes) if path[-1] != spec["all_label"]]
+    leaf_data = [boxes[n][1]["data"] for n in leaf_idx]
+    leaf_offsets = np.r_[0, np.cumsum([len(d) for d in leaf_data])]
+    leaf_values = joinViews(leaf_data)
+
+    # "All" boxes, each merged from the runs of its siblings
+    children = {}
+    for i, n in enumerate(leaf_idx):
+        children.setdefault(boxes[n][0][:-1], []).append(i)
+    all_idx = []
+    all_runs = []
+    for n, (path, box) in enumerate(boxes):
+        if path[-1] != spec["all_label"]:
+            continue
+        first, last = min(children[path[:-1]]), max(children[path[:-1]])
+        all_idx.append(n)
+        all_runs.append(leaf_offsets[first:last + 2])
+    all_offsets = np.r_[0, np.cumsum([runs[-1] - runs[0] for runs in all_runs])].astype(np.int64)
+    all_values = np.empty(all_offsets[-1], dtype=leaf_values.dtype)
+    for n, runs in enumerate(all_runs):
+        merged = all_values[all_offsets[n]:all_offsets[n + 1]]
+        merged[:] = leaf_values[runs[0]:runs[-1]]
+        if len(runs) > 2:
+            # A stable sort detects the presorted runs and merges them
+            # instead of sorting the data again from scratch
+            merged.sort(kind="stable")
+
+    return boxes, (leaf_idx, leaf_values, leaf_offsets), (all_idx, all_values, all_offsets, all_runs)
+
+
+def treeStats(tree, spec=DEFAULT_SPEC, whis=1.5):
+
+    """
+    Compute the Axes.bxp statistics for every box of a grouped tree,
+    in plotting order.
+
+    The data of each individual box must be sorted ascending (as
+    returned by grouping.groupData); the "All" boxes are derived by
+    merging the sorted data of their sibling boxes.
+    """
+    boxes = list(iterBoxes(tree))
+    if boxes and "sketch" in boxes[0][1]:
+        return [sketchStats(box["sketch"], whis=whis, label=path[-1]) for path, box in boxes]
+
+    boxes, leaves, alls = treeSegments(tree, spec)
+    stats = [None] * len(boxes)
+    for idx, values, offsets in (leaves, alls[:3]):
+        if not idx:
+            continue
+        seg = segmentStats(values, offsets, whis=whis)
+        for i, n in enumerate(idx):
+            stats[n] = dict((k, v[i]) for k, v in seg.items())
+            stats[n]["label"] = boxes[n][0][-1]
+
+    return stats
+
+
+def metricStats(trees, spec=DEFAULT_SPEC, whis=1.5):
+
+    """
+    Compute the Axes.bxp statistics of several trees with the same boxes
+    (one per value column, see grouping.metricsData) in one pass: the
+    segments of every box of every tree go through segmentStats together.
+
+    Returns an OrderedDict of the statistics of each tree, in plotting order.
+    """
+    parts = []
+    values = []
+    offsets = [np.zeros(1, dtype=np.int64)]
+    total = 0
+    for name, tree in trees.items():
+        boxes, leaves, alls = treeSegments(tree, spec)
+        parts.append((name, boxes, [idx for idx, segment_values, segment_offsets in (leaves, alls[:3])]))
+        for idx, segment_values, segment_offsets in (leaves, alls[:3]):
+            values.append(segment_values)
+            offsets.append(np.asarray(segment_offsets[1:], dtype=np.int64) + total)
+            total += len(segment_values)
+    seg = segmentStats(np.concatenate(values) if values else np.empty(0), np.concatenate(offsets), whis=whis)
+
+    results = OrderedDict()
+    i = 0
+    for name, boxes, groups in parts:
+        stats = [None] * len(boxes)
+        for idx in groups:
+            for n in idx:
+                stats[n] = dict((k, v[i]) for k, v in seg.items())
+                stats[n]["label"] = boxes[n][0][-1]
+                i += 1
+        results[name] = stats
+    return results
+
+
+def sketchStats(sketch, whis=1.5, label=None):
+
+    """
+    Compute approximate Axes.bxp statistics from a quantile sketch.
+
+    Quartiles come from the sketch; whiskers and fliers are taken from
+    the items the sketch retained plus the exact minimum and maximum.
+    """
+    q1, med, q3 = sketch.quantile([0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    items = np.r_[sketch.min, sketch.weightedItems()[0], sketch.max]
+    inside = (items >= q1 - whis * iqr) & (items <= q3 + whis * iqr)
+    whislo = min(items[inside].min(), q1) if inside.any() else q1
+    whishi = max(items[inside].max(), q3) if inside.any() else q3
+    notch = 1.57 * iqr / np.sqrt(sketch.count)
+    return {"n": sketch.count,
+            "rank_error": sketch.rank_error,
+            "mean": sketch.total / sketch.count,
+            "med": med,
+            "q1": q1,
+            "q3": q3,
+            "iqr": iqr,
+            "whislo": whislo,
+            "whishi": whishi,
+            "cilo": med - notch,
+            "cihi": med + notch,
+            "fliers": np.unique(items[~inside]),
+            "label": label,
+            }
+
+
+def statsReport(tree, stats):
+
+    """
+    Subroutine for a tab-separated table of the box statistics,
+    one line per box with the rank error bound next to the quartiles
+    and the confidence interval of the median
+    """
+    lines = ["\t".join(["box", "n", "q1", "median", "q3", "mean", "rank_error", "median_ci_low", "median_ci_high"])]
+    for (path, box), s in zip(iterBoxes(tree), stats):
+        lines.append("\t".join(["/".join(str(p) for p in path), "%d" % s["n"]] +
+                               ["%g" % s[k] for k in ("q1", "med", "q3", "mean", "rank_error", "cilo", "cihi")]))
+    return "\n".join(lines) + "\n"
+
+
+def statsRange(stats):
+
+    """
+    Subroutine for the smallest and largest value shown by a list of box statistics
+    """
+    lows = [min(s["whislo"], np.min(s["fliers"], initial=s["whislo"])) for s in stats]
+    highs = [max(s["whishi"], np.max(s["fliers"], initial=s["whishi"])) for s in stats]
+    return min(lows), max(highs)
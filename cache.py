@@ -0,0 +1,209 @@
+"""
+On-disk cache of parsed and grouped input data.
+
+Parsing a large CSV dominates the time of a render whose input has
+not changed (e.g. while only tuning styling configurables). The cache
+stores the output of grouping.groupColumns as plain .npy files, which
+are loaded back memory-mapped, so a cache hit costs milliseconds and
+no copy of the data.
+
+Entries are content-addressed: an entry is named after the SHA-1 of
+the input file and of the parts of the spec that affect the grouping,
+plus the storage type of the values when one is requested (see
+grouping.compactValues) and the SHA-1 of the selected value columns
+when several are grouped together (see grouping.groupMetrics).
+An index maps (absolute path, size, mtime) to the content hash, so an
+unchanged file is not even re-hashed; a changed stat triggers a
+re-hash, which still hits if the content is the same.
+
+Layout of the cache directory:
+
+    index.json                  {path: [size, mtime, sha1]}
+    <sha1>-<spec sha1>[-<dtype>][-<metrics sha1>]/
+        values.npy              sorted value column
+        values_<n>.npy          sorted value columns, for several columns
+        offsets.npy             leaf boundaries into values
+        meta.json               value column name(s) and leaf keys
+"""
+
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from grouping import DEFAULT_SPEC, columnsTree, groupMetrics, metricTrees, valueColumns
+
+
+def fileDigest(path, block_size=1 << 20):
+
+    """
+    Subroutine for the SHA-1 of a file's content
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as stream:
+        for block in iter(lambda: stream.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def specDigest(spec=DEFAULT_SPEC):
+
+    """
+    Subroutine for the SHA-1 of the spec entries that change the grouped columns
+    """
+    key = json.dumps([list(spec["levels"]), sorted((k, list(v)) for k, v in spec["order"].items())])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def writeJson(path, obj):
+
+    """
+    Subroutine for atomically replacing a JSON file
+    """
+    handle, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(handle, "w") as stream:
+        json.dump(obj, stream)
+    os.rename(tmp, path)
+
+
+def plainValue(value):
+
+    """
+    Subroutine for turning NumPy scalars into JSON-serializable values
+    """
+    return value.item() if hasattr(value, "item") else value
+
+
+class ColumnCache(object):
+
+    """
+    Content-addressed cache of grouped columns in cache_dir
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.index_path = os.path.join(cache_dir, "index.json")
+
+    def readIndex(self):
+        try:
+            with open(self.index_path) as stream:
+                return json.load(stream)
+        except (IOError, ValueError):
+            return {}
+
+    def contentDigest(self, infile):
+
+        """
+        SHA-1 of infile, taken from the index while its size and mtime are unchanged
+        """
+        path = os.path.abspath(infile)
+        stat = os.stat(path)
+        stamp = [stat.st_size, stat.st_mtime]
+        index = self.readIndex()
+        entry = index.get(path)
+        if entry and entry[:2] == stamp:
+            return entry[2]
+        digest = fileDigest(path)
+        index[path] = stamp + [digest]
+        writeJson(self.index_path, index)
+        return digest
+
+    def entryDir(self, infile, spec, dtype=None, metrics=None):
+        name = "%s-%s" % (self.contentDigest(infile), specDigest(spec))
+        if dtype is not None:
+            name += "-%s" % dtype
+        if metrics is not None:
+            name += "-%s" % hashlib.sha1(json.dumps(metrics).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, name)
+
+    def load(self, entry):
+
+        """
+        Memory-map the columns of a cache entry, or return None on a miss
+        """
+        try:
+            with open(os.path.join(entry, "meta.json")) as stream:
+                meta = json.load(stream)
+            if "metrics" in meta:
+                files = [(name, "values_%d.npy" % n) for n, name in enumerate(meta["metrics"])]
+            else:
+                files = [(meta["data_name"], "values.npy")]
+            columns = OrderedDict((name, np.load(os.path.join(entry, path), mmap_mode="r")) for name, path in files)
+            offsets = np.load(os.path.join(entry, "offsets.npy"))
+        except (IOError, OSError, ValueError):
+            return None
+        return columns, offsets, [tuple(k) for k in meta["leaf_keys"]]
+
+    def store(self, entry, columns, offsets, leaf_keys):
+
+        """
+        Write a cache entry; written to a temporary directory first so
+        that concurrent renders never see a partial entry
+        """
+        tmp = tempfile.mkdtemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            meta = {"leaf_keys": [[plainValue(v) for v in k] for k in leaf_keys]}
+            if len(columns) == 1:
+                meta["data_name"], values = list(columns.items())[0]
+                np.save(os.path.join(tmp, "values.npy"), np.ascontiguousarray(values))
+            else:
+                meta["metrics"] = list(columns.keys())
+                for n, values in enumerate(columns.values()):
+                    np.save(os.path.join(tmp, "values_%d.npy" % n), np.ascontiguousarray(values))
+            np.save(os.path.join(tmp, "offsets.npy"), offsets)
+            with open(os.path.join(tmp, "meta.json"), "w") as stream:
+                json.dump(meta, stream)
+            os.rename(tmp, entry)
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def groupedMetrics(self, infile, spec=DEFAULT_SPEC, dtype=None, metrics=None):
+
+        """
+        Grouped value columns of infile (see grouping.groupMetrics and
+        grouping.valueColumns), from the cache when possible, parsing and
+        caching them otherwise
+        """
+        entry = self.entryDir(infile, spec, dtype, metrics)
+        grouped = self.load(entry)
+        if grouped is None:
+            import pandas as pd
+
+            read_data = pd.read_csv(infile)
+            grouped = groupMetrics(read_data, valueColumns(read_data, metrics, spec), spec, dtype)
+            self.store(entry, *grouped)
+        return grouped
+
+    def groupedColumns(self, infile, spec=DEFAULT_SPEC, dtype=None):
+
+        """
+        Grouped columns of infile (see grouping.groupColumns), from the
+        cache when possible, parsing and caching them otherwise
+        """
+        columns, offsets, leaf_keys = self.groupedMetrics(infile, spec, dtype)
+        return list(columns.values())[0], offsets, leaf_keys
+
+
+def cachedData(infile, cache_dir, spec=DEFAULT_SPEC, dtype=None):
+
+    """
+    Cached counterpart of reading infile and calling grouping.groupData
+    """
+    values, offsets, leaf_keys = ColumnCache(cache_dir).groupedColumns(infile, spec, dtype)
+    return columnsTree(values, offsets, leaf_keys, spec)
+
+
+def cachedMetrics(infile, cache_dir, spec=DEFAULT_SPEC, dtype=None, metrics=None):
+
+    """
+    Cached counterpart of reading infile and calling grouping.metricsData
+    """
+    return metricTrees(*ColumnCache(cache_dir).groupedMetrics(infile, spec, dtype, metrics), spec=spec)
@@ -0,0 +1,373 @@
+"""
+Grouping engine for the nested box plots.
+
+Builds the Channel -> Geno -> Animal tree (including the "All"
+parent boxes) in a single sort pass over the input data, driven
+by a small declarative spec instead of a hand-written dictionary.
+
+The tree has the same shape as the old mega_data_dict:
+
+    tree[channel][geno][box_label] = OrderedDict([("width", ...),
+                                                  ("color", ...),
+                                                  ("data", ...)])
+
+where data is a NumPy view into one sorted copy of the value column:
+the values are stored once, grouped by box, and the data of an "All"
+box is the view spanning its children rather than a copy of theirs.
+The data of each individual box is sorted ascending. The value column
+can be stored in a narrower type (see compactValues), and several value
+columns can be grouped in the same pass, into one tree per column with
+the same boxes (see groupMetrics and metricsData).
+"""
+
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+"""
+Default spec
+
+levels        columns defining the nesting, outermost first
+order         preferred ordering of the values of each level; values
+              that are not listed follow in sorted order
+palette_level level whose value selects the colour palette
+palette       colours of the leaf boxes, handed out by the rank of their
+              last level value among all values of their palette group
+leaf_width    width of the individual boxes
+leaf_prefix   prefix of the individual box labels (A1, A2, ...)
+all_label     label of the parent box combining all of its children
+all_color     colour of the parent box
+all_width     width of the parent box
+all_position  where the parent box sits between its children:
+              "middle", "first", "last" or an integer index
+"""
+DEFAULT_SPEC = OrderedDict([("levels", ["Channel", "Geno", "Animal"]),
+                            ("order", OrderedDict([("Channel", ["VGLUT2", "GlyT2", "GAD67"]),
+                                                   ("Geno", ["wt", "ko"]),
+                                                   ])),
+                            ("palette_level", "Geno"),
+                            ("palette", OrderedDict([("wt", ["#a63603", "#e6550d", "#fd8d3c", "#fdb385"]),
+                                                     ("ko", ["#54278f", "#756bb1", "#9e9ac8", "#acbfef"]),
+                                                     ])),
+                            ("leaf_width", 0.2),
+                            ("leaf_prefix", "A"),
+                            ("all_label", "All"),
+                            ("all_color", "#000000"),
+                            ("all_width", 2.),
+                            ("all_position", "middle"),
+                            ])
+
+
+def getValueColumn(read_data, spec=DEFAULT_SPEC):
+
+    """
+    Subroutine for picking the single non-key column of the input
+    """
+    value_cols = [c for c in read_data.columns if c not in spec["levels"]]
+    if not value_cols:
+        raise ValueError("no value column besides %s" % ", ".join(spec["levels"]))
+    return value_cols[0]
+
+
+def orderLevel(values, preferred):
+
+    """
+    Subroutine for ordering the distinct values of one level:
+    preferred values first (in the given order), the rest sorted
+    """
+    preferred = [v for v in (preferred or []) if v in values]
+    rest = sorted(v for v in values if v not in preferred)
+    return preferred + rest
+
+
+def allSlot(n_children, position):
+
+    """
+    Subroutine for the index of the "All" box among its children
+    """
+    if position == "first":
+        return 0
+    if position == "last":
+        return n_children
+    if position == "middle":
+        return n_children // 2
+    return max(0, min(int(position), n_children))
+
+
+def groupKeys(read_data, spec=DEFAULT_SPEC):
+
+    """
+    Subroutine for encoding the level columns as one integer key per row
+
+    Returns the combined key per row and, for each level, the ordered
+    distinct values its code refers to. Rows missing a level value
+    belong to no box and get the key -1.
+    """
+    # pandas is loaded by whoever read the frame; importing it here keeps
+    # it out of the renders served from the cache
+    import pandas as pd
+
+    key = np.zeros(len(read_data), dtype=np.int64)
+    missing = np.zeros(len(read_data), dtype=bool)
+    uniques = []
+    for level in spec["levels"]:
+        codes, values = pd.factorize(read_data[level])
+        ordered = orderLevel(list(values), spec["order"].get(level))
+        position = dict((v, n) for n, v in enumerate(ordered))
+        # factorize codes a missing value as -1, which picks the 0 appended last
+        rank = np.array([position[v] for v in values] + [0], dtype=np.int64)
+        key = key * max(len(ordered), 1) + rank[codes]
+        missing |= codes < 0
+        uniques.append(ordered)
+    key[missing] = -1
+    return key, uniques
+
+
+def decodeKey(key, uniques):
+
+    """
+    Subroutine for turning a combined key back into level values
+    """
+    values = []
+    for ordered in reversed(uniques):
+        key, code = divmod(int(key), len(ordered))
+        values.append(ordered[code])
+    return tuple(reversed(values))
+
+
+def boxLabel(value, spec=DEFAULT_SPEC):
+
+    """
+    Subroutine for the label of an individual box
+    """
+    return "%s%s" % (spec["leaf_prefix"], value)
+
+
+def compactValues(values, dtype=None):
+
+    """
+    Subroutine for storing the value column in a narrower type
+
+    None keeps the parsed type and any other dtype is applied as given
+    (e.g. "float32"). "auto" picks the narrowest integer type holding
+    integral values, or float32 when no value changes in it, and keeps
+    the parsed type otherwise.
+    """
+    values = np.asarray(values)
+    if dtype is None:
+        return values
+    if dtype != "auto":
+        return values.astype(dtype, copy=False)
+    if not len(values):
+        return values
+    if values.dtype.kind in "iu" or (values.dtype.kind == "f" and np.all(np.mod(values, 1) == 0)):
+        lo, hi = values.min(), values.max()
+        for candidate in (np.int8, np.int16, np.int32, np.int64):
+            if np.iinfo(candidate).min <= lo and hi <= np.iinfo(candidate).max:
+                return values.astype(candidate, copy=False)
+    if values.dtype.kind == "f" and values.dtype.itemsize > 4:
+        narrow = values.astype(np.float32)
+        if np.array_equal(narrow, values):
+            return narrow
+    return values
+
+
+def valueColumns(read_data, metrics=None, spec=DEFAULT_SPEC):
+
+    """
+    Subroutine for the value columns to plot: the single value column
+    for None, every numeric non-key column for "all" (text columns such
+    as IDs are skipped), or the listed columns (a single name may be
+    given as a string)
+    """
+    import pandas as pd
+
+    if metrics is None:
+        return [getValueColumn(read_data, spec)]
+    available = [c for c in read_data.columns if c not in spec["levels"]]
+    if metrics == "all":
+        numeric = [c for c in available if pd.api.types.is_numeric_dtype(read_data[c])]
+        if not numeric:
+            raise ValueError("no numeric value column besides %s" % ", ".join(spec["levels"]))
+        return numeric
+    if not isinstance(metrics, (list, tuple)):
+        metrics = [metrics]
+    missing = [m for m in metrics if m not in available]
+    if missing or not metrics:
+        raise ValueError("unknown value column(s): %s" % ", ".join(str(m) for m in missing or ["(none given)"]))
+    text = [m for m in metrics if not pd.api.types.is_numeric_dtype(read_data[m])]
+    if text:
+        raise ValueError("value column(s) not numeric: %s" % ", ".join(str(m) for m in text))
+    return list(metrics)
+
+
+def groupMetrics(read_data, data_names, spec=DEFAULT_SPEC, dtype=None):
+
+    """
+    Group one or more value columns into flat sorted columns.
+
+    The level columns are encoded into one key per row once for all
+    value columns. Sorting each column on (combined level key, value)
+    puts every leaf group, and every parent group, in a contiguous run
+    of its sorted values, with the values of each leaf in ascending
+    order; the group boundaries, shared by all columns, come from a
+    single scan for key changes.
+
+    Returns (sorted values per column name, offsets, leaf keys): leaf n
+    holds values[offsets[n]:offsets[n + 1]] of every column and
+    leaf_keys[n] is its tuple of level values, in plotting order. The
+    values are stored as dtype (see compactValues). Rows missing a level
+    value are left out, as they are by the streaming mode.
+    """
+    key, uniques = groupKeys(read_data, spec)
+    complete = key >= 0
+    if complete.all():
+        complete = slice(None)
+    key = key[complete]
+    columns = OrderedDict()
+    sorted_key = np.empty(0, dtype=np.int64)
+    for n, data_name in enumerate(data_names):
+        values = compactValues(np.asarray(read_data[data_name])[complete], dtype)
+        order = np.lexsort((values, key))
+        columns[data_name] = values[order]
+        if not n:
+            sorted_key = key[order]
+
+    starts = np.flatnonzero(np.r_[True, sorted_key[1:] != sorted_key[:-1]])[:len(sorted_key)]
+    offsets = np.r_[starts, len(sorted_key)].astype(np.int64)
+    leaf_keys = [decodeKey(sorted_key[start], uniques) for start in starts]
+    return columns, offsets, leaf_keys
+
+
+def groupColumns(read_data, data_name=None, spec=DEFAULT_SPEC, dtype=None):
+
+    """
+    Group the value column into flat sorted columns (see groupMetrics).
+
+    Returns (sorted values, offsets, leaf keys).
+    """
+    if data_name is None:
+        data_name = getValueColumn(read_data, spec)
+    columns, offsets, leaf_keys = groupMetrics(read_data, [data_name], spec, dtype)
+    return columns[data_name], offsets, leaf_keys
+
+
+def columnsTree(values, offsets, leaf_keys, spec=DEFAULT_SPEC):
+
+    """
+    Build the nested box tree from flat grouped columns (see groupColumns);
+    every box's data is a view into values
+    """
+    # Collect the leaves under their parent, in plotting order
+    runs = OrderedDict()
+    for n, levels in enumerate(leaf_keys):
+        runs.setdefault(tuple(levels[:-1]), []).append((levels[-1], offsets[n], offsets[n + 1]))
+
+    # The children of one parent are adjacent, so the parent's data
+    # is the run spanning them
+    parents = OrderedDict()
+    for parent, leaves in runs.items():
+        children = [(value, {"data": values[start:end]}) for value, start, end in leaves]
+        parents[parent] = (children, {"data": values[leaves[0][1]:leaves[-1][2]]})
+
+    return buildTree(parents, spec)
+
+
+def groupData(read_data, data_name=None, spec=DEFAULT_SPEC, dtype=None):
+
+    """
+    Group the value column into the nested box tree, in one sort pass
+    (see groupColumns)
+    """
+    return columnsTree(*groupColumns(read_data, data_name, spec, dtype), spec=spec)
+
+
+def metricTrees(columns, offsets, leaf_keys, spec=DEFAULT_SPEC):
+
+    """
+    Subroutine for one nested box tree per value column of groupMetrics,
+    as an OrderedDict keyed by column name
+    """
+    return OrderedDict((data_name, columnsTree(values, offsets, leaf_keys, spec))
+                       for data_name, values in columns.items())
+
+
+def metricsData(read_data, metrics=None, spec=DEFAULT_SPEC, dtype=None):
+
+    """
+    Group the selected value columns (see valueColumns) into one nested
+    box tree each, in one grouping pass
+    """
+    return metricTrees(*groupMetrics(read_data, valueColumns(read_data, metrics, spec), spec, dtype), spec=spec)
+
+
+def orderPaths(paths, spec=DEFAULT_SPEC):
+
+    """
+    Subroutine for sorting level-value tuples into plotting order
+    """
+    paths = list(paths)
+    ranks = []
+    for n in range(len(paths[0]) if paths else 0):
+        ordered = orderLevel(list(set(p[n] for p in paths)), spec["order"].get(spec["levels"][n]))
+        ranks.append(dict((v, r) for r, v in enumerate(ordered)))
+    return sorted(paths, key=lambda p: tuple(ranks[n][v] for n, v in enumerate(p)))
+
+
+def buildTree(parents, spec=DEFAULT_SPEC):
+
+    """
+    Assemble the nested box tree.
+
+    parents maps each parent path (level values without the last level,
+    in plotting order) to (children, all_fields): children is a list of
+    (last level value, fields) and all_fields the fields of the "All"
+    box. Width and colour are added to the fields from the spec.
+
+    Each individual box is coloured by the rank of its value among all
+    the values of its palette group in the tree, so an animal keeps its
+    colour in every parent, even where some of its siblings are missing.
+    """
+    palette_idx = spec["levels"].index(spec["palette_level"])
+    group_values = OrderedDict()
+    for parent, (children, all_fields) in parents.items():
+        group_values.setdefault(parent[palette_idx], set()).update(value for value, fields in children)
+    ranks = dict((group, dict((v, n) for n, v in enumerate(orderLevel(list(values),
+                                                                      spec["order"].get(spec["levels"][-1])))))
+                 for group, values in group_values.items())
+
+    tree = OrderedDict()
+    for parent, (children, all_fields) in parents.items():
+        palette = spec["palette"].get(parent[palette_idx], [])
+        rank = ranks[parent[palette_idx]]
+        boxes = []
+        for value, fields in children:
+            color = palette[rank[value] % len(palette)] if palette else spec["all_color"]
+            boxes.append((boxLabel(value, spec),
+                          OrderedDict([("width", spec["leaf_width"]), ("color", color)] + list(fields.items()))))
+        all_box = (spec["all_label"],
+                   OrderedDict([("width", spec["all_width"]), ("color", spec["all_color"])] + list(all_fields.items())))
+        boxes.insert(allSlot(len(children), spec["all_position"]), all_box)
+
+        node = tree
+        for value in parent[:-1]:
+            node = node.setdefault(value, OrderedDict())
+        node[parent[-1]] = OrderedDict(boxes)
+
+    return tree
+
+
+def iterBoxes(tree, path=()):
+
+    """
+    Iterate over the boxes of a tree in plotting order,
+    yielding (path, box) where path holds the level values and box label
+    """
+    for name, node in tree.items():
+        if "data" in node:
+            yield path + (name,), node
+        else:
+            for item in iterBoxes(node, path + (name,)):
+                yield item
@@ -0,0 +1,408 @@
+"""
+Incremental refresh of a nested box plot whose input CSV grows by appends.
+
+Command line call:
+python incremental.py data.csv plot.png --state-dir state
+python incremental.py data.csv plot.png --state-dir state --watch 30
+
+IncrementalPlot remembers the sorted data of every
+(Channel, Geno, Animal) group, the box statistics and the byte offset
+up to which the file has been read. A refresh reads only the bytes
+appended since then (complete lines only), merges them into the groups
+they belong to and recomputes the statistics of those groups and of
+their "All" parents only. The box collections of the figure template
+are then moved to the statistics (one pass over the segments of all
+boxes) and the scatter is laid out again. New groups (e.g. a new
+animal) change the layout: the figure is drawn again, still with the
+statistics of the untouched groups kept. A file that shrank or whose
+already-read part changed is read again from the start.
+
+With a state directory the groups, their box statistics and the offset
+survive between runs. Every group is stored in a file of its own,
+written again only when the group changes and memory-mapped when
+loaded, so saving costs the size of the touched groups rather than of
+the history; a new process neither re-parses the history nor
+recomputes the statistics of the groups the new rows did not touch
+(the figure itself is drawn again). With --watch the process keeps the
+figure and refreshes it periodically.
+Only the exact (non-streaming) mode is supported.
+"""
+
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from grouping import boxLabel, columnsTree, getValueColumn, groupColumns, iterBoxes, orderPaths
+from box_stats import statsReport
+from cache import plainValue, writeJson
+
+
+FINGERPRINT_BYTES = 65536
+
+
+def fileFingerprint(path, offset):
+
+    """
+    Subroutine for the SHA-1 of the start of a file and of the bytes just
+    before offset, used to detect that the part already read has changed
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as stream:
+        digest.update(stream.read(min(FINGERPRINT_BYTES, offset)))
+        start = max(0, offset - FINGERPRINT_BYTES)
+        stream.seek(start)
+        digest.update(stream.read(offset - start))
+    return digest.hexdigest()
+
+
+def readHeader(path):
+
+    """
+    Subroutine for the column names of a CSV and the byte offset of its first data line
+    """
+    with open(path, "rb") as stream:
+        first_line = stream.readline()
+    columns = list(pd.read_csv(io.BytesIO(first_line), nrows=0).columns)
+    return columns, len(first_line)
+
+
+def readTail(path, offset, columns):
+
+    """
+    Parse the complete lines of a CSV after byte offset.
+    Returns (frame or None, offset after the last complete line).
+    """
+    with open(path, "rb") as stream:
+        stream.seek(offset)
+        data = stream.read()
+    end = data.rfind(b"\n") + 1
+    if not end:
+        return None, offset
+    return pd.read_csv(io.BytesIO(data[:end]), header=None, names=columns), offset + end
+
+
+def configDigest(config):
+
+    """
+    Subroutine for the SHA-1 of a configuration, telling whether saved statistics still apply
+    """
+    return hashlib.sha1(repr(list(config.items())).encode("utf-8")).hexdigest()
+
+
+def plainStats(stats):
+
+    """
+    Subroutine for turning box statistics into JSON-serializable dicts
+    """
+    return [dict((k, [plainValue(f) for f in v] if k == "fliers" else plainValue(v)) for k, v in s.items())
+            for s in stats]
+
+
+def loadStats(stats):
+
+    """
+    Subroutine for box statistics read back from plainStats
+    """
+    return [dict((k, np.asarray(v, dtype=np.float64) if k == "fliers" else v) for k, v in s.items())
+            for s in stats]
+
+
+def mergeSorted(a, b):
+
+    """
+    Subroutine for merging two sorted arrays; a stable sort merges the two runs
+    """
+    return np.sort(np.concatenate([a, b]), kind="stable")
+
+
+class IncrementalPlot(object):
+
+    """
+    Nested box plot of a growing CSV, refreshed from the appended tail only
+    """
+
+    def __init__(self, infile, outfile, config=None, state_dir=None, **overrides):
+        from nested_box_plots import makeConfig
+
+        self.infile = infile
+        self.outfile = outfile
+        self.config = makeConfig(config, **overrides)
+        self.spec = self.config["spec"]
+        self.state_dir = state_dir
+        self.leaves = None
+        self.columns = None
+        self.data_name = None
+        self.offset = 0
+        self.fingerprint = None
+        self.tree = None
+        self.template = None
+        self.index = {}
+        # Statistics of the boxes as saved by the last run, by box path
+        self.saved_stats = None
+        # File of the state directory holding each group, for the groups
+        # saved since they last changed
+        self.files = OrderedDict()
+        self.next_file = 0
+        if state_dir:
+            self.loadState()
+
+    def loadState(self):
+
+        """
+        Subroutine for restoring the groups, statistics and offset saved
+        by saveState; the groups are memory-mapped
+        """
+        try:
+            with open(os.path.join(self.state_dir, "state.json")) as stream:
+                state = json.load(stream)
+            if state["infile"] != os.path.abspath(self.infile):
+                return
+            files = OrderedDict((tuple(k), name) for k, name in state["groups"])
+            leaves = OrderedDict((key, np.load(os.path.join(self.state_dir, name), mmap_mode="r"))
+                                 for key, name in files.items())
+        except (IOError, OSError, ValueError, KeyError):
+            return
+        self.leaves = leaves
+        self.files = files
+        self.next_file = state["next_file"]
+        self.columns = state["columns"]
+        self.data_name = state["data_name"]
+        self.offset = state["offset"]
+        self.fingerprint = state["fingerprint"]
+        if state.get("stats_config") == configDigest(self.config):
+            self.saved_stats = dict((tuple(p), s) for p, s in zip(state["stats_paths"], loadStats(state["stats"])))
+
+    def saveState(self):
+
+        """
+        Subroutine for saving the groups, statistics and offset; only the
+        groups that changed since the last save are written, each to a
+        new file, and state.json is replaced last, so that an interrupted
+        save leaves the previous state intact
+        """
+        if not os.path.isdir(self.state_dir):
+            os.makedirs(self.state_dir)
+        for key, values in self.leaves.items():
+            if key not in self.files:
+                name = "%d.npy" % self.next_file
+                self.next_file += 1
+                np.save(os.path.join(self.state_dir, name), values)
+                self.files[key] = name
+        writeJson(os.path.join(self.state_dir, "state.json"),
+                  {"infile": os.path.abspath(self.infile),
+                   "columns": self.columns,
+                   "data_name": self.data_name,
+                   "offset": self.offset,
+                   "fingerprint": fileFingerprint(self.infile, self.offset),
+                   "groups": [[[plainValue(v) for v in key], self.files[key]] for key in self.leaves],
+                   "next_file": self.next_file,
+                   "stats_config": configDigest(self.config),
+                   "stats_paths": [[plainValue(v) for v in p] for p in self.template.paths],
+                   "stats": plainStats(self.template.stats)})
+        # Files of groups that changed since, or of an earlier layout
+        kept = set(self.files[key] for key in self.leaves)
+        for name in os.listdir(self.state_dir):
+            if name.endswith(".npy") and name not in kept:
+                try:
+                    os.remove(os.path.join(self.state_dir, name))
+                except OSError:
+                    pass
+
+    def isAppendOnly(self):
+
+        """
+        Subroutine for checking that the file only grew since the last read
+        """
+        if self.leaves is None or os.path.getsize(self.infile) < self.offset:
+            return False
+        return fileFingerprint(self.infile, self.offset) == self.fingerprint
+
+    def refresh(self):
+
+        """
+        Bring the groups, statistics and figure up to date with the file.
+        Returns the paths of the boxes that changed.
+        """
+        if not self.isAppendOnly():
+            self.columns, self.offset = readHeader(self.infile)
+            self.leaves = OrderedDict()
+            self.files = OrderedDict()
+            # The rewritten file may have another value column
+            self.data_name = None
+            self.saved_stats = None
+            self.close()
+        frame, offset = readTail(self.infile, self.offset, self.columns)
+        if self.data_name is None:
+            self.data_name = getValueColumn(pd.DataFrame(columns=self.columns), self.spec)
+
+        changed = []
+        new_groups = False
+        if frame is not None and len(frame):
+            values, offsets, keys = groupColumns(frame, self.data_name, self.spec, self.config["value_dtype"])
+            for n, key in enumerate(keys):
+                run = values[offsets[n]:offsets[n + 1]]
+                if key in self.leaves:
+                    self.leaves[key] = mergeSorted(self.leaves[key], run)
+                else:
+                    self.leaves[key] = run
+                    new_groups = True
+                self.files.pop(key, None)
+                changed.append(key)
+        self.offset = offset
+        self.fingerprint = fileFingerprint(self.infile, self.offset)
+
+        if not self.leaves:
+            return []
+        saved_stats, self.saved_stats = self.saved_stats, None
+        if self.template is None or new_groups:
+            # The statistics of the groups the new rows did not touch are
+            # those of the figure, or those saved by the last run
+            known = saved_stats if self.template is None else dict(zip(self.template.paths, self.template.stats))
+            return self.rebuild(known, changed)
+        if changed:
+            return self.updateGroups(changed)
+        return []
+
+    def rebuild(self, known=None, changed=()):
+
+        """
+        Subroutine for building the tree and the figure from all groups.
+        known maps box paths to their statistics, which are kept for the
+        boxes whose parent has none of the changed leaf keys; without it
+        the statistics of all boxes are computed. Returns the paths of
+        the boxes whose statistics changed.
+        """
+        from nested_box_plots import drawPlot
+
+        keys = orderPaths(self.leaves.keys(), self.spec)
+        self.leaves = OrderedDict((key, self.leaves[key]) for key in keys)
+        values = np.concatenate(list(self.leaves.values()))
+        offsets = np.r_[0, np.cumsum([len(v) for v in self.leaves.values()])]
+        self.tree = columnsTree(values, offsets, keys, self.spec)
+        paths = [path for path, box in iterBoxes(self.tree)]
+        stats = None
+        if known is not None:
+            fresh = self.parentStats(changed)
+            if all(path in fresh or path in known for path in paths):
+                stats = [fresh[path] if path in fresh else known[path] for path in paths]
+        self.close()
+        self.template = drawPlot(self.tree, self.config, stats=stats)
+        self.index = dict((path, n) for n, path in enumerate(self.template.paths))
+        if stats is None:
+            return list(self.template.paths)
+        affected = self.affectedPaths(changed)
+        return [path for path in self.template.paths if path in affected]
+
+    def affectedPaths(self, keys):
+
+        """
+        Subroutine for the paths of the boxes of changed leaf keys and of their "All" parents
+        """
+        affected = set()
+        for key in keys:
+            affected.update([key[:-1] + (boxLabel(key[-1], self.spec),), key[:-1] + (self.spec["all_label"],)])
+        return affected
+
+    def parentStats(self, keys):
+
+        """
+        Subroutine for the statistics of the boxes under the parents of
+        the changed leaf keys only, as a dict from box path to statistics
+        """
+        from template import figureStats
+
+        subtree = OrderedDict()
+        for key in keys:
+            node = self.tree
+            for value in key[:-1]:
+                node = node[value]
+            sub = subtree
+            for value in key[:-2]:
+                sub = sub.setdefault(value, OrderedDict())
+            sub[key[-2]] = node
+        if not subtree:
+            return {}
+        return dict(zip([path for path, box in iterBoxes(subtree)], figureStats(subtree, self.config)))
+
+    def updateGroups(self, keys):
+
+        """
+        Subroutine for pushing changed groups into the tree, recomputing the
+        statistics of those groups and their "All" parents only
+        """
+        all_label = self.spec["all_label"]
+        parents = OrderedDict()
+        for key in keys:
+            node = self.tree
+            for value in key[:-1]:
+                node = node[value]
+            node[boxLabel(key[-1], self.spec)]["data"] = self.leaves[key]
+            parents[key[:-1]] = node
+        for node in parents.values():
+            node[all_label]["data"] = np.concatenate([box["data"] for label, box in node.items() if label != all_label])
+
+        # Only the changed parents go through the statistics engine (the
+        # "All" box needs all of its children), and only the changed boxes
+        # and their "All" parents get new statistics
+        affected = self.affectedPaths(keys)
+        changed = dict((self.index[path], s) for path, s in self.parentStats(keys).items() if path in affected)
+        self.template.updateSome(self.tree, changed)
+        return [self.template.paths[idx] for idx in sorted(changed)]
+
+    def render(self):
+
+        """
+        Refresh and, if anything changed, save the plot (and the state).
+        Returns the paths of the boxes that changed.
+        """
+        changed = self.refresh()
+        if changed:
+            if self.config["stats_report"]:
+                with open(os.path.splitext(self.outfile)[0] + "_stats.txt", "w") as report:
+                    report.write(statsReport(self.tree, self.template.stats))
+            self.template.save(self.outfile)
+        if self.state_dir and self.leaves:
+            self.saveState()
+        return changed
+
+    def close(self):
+        if self.template is not None:
+            self.template.close()
+        self.template = None
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Refresh a nested box plot from the rows appended to its input.")
+    parser.add_argument("infile", help="input CSV, appended to over time")
+    parser.add_argument("outfile", help="output plot")
+    parser.add_argument("--state-dir", help="directory keeping the groups, statistics and read offset between runs")
+    parser.add_argument("--watch", type=float, default=None, metavar="SECONDS",
+                        help="keep running and refresh every SECONDS")
+    args = parser.parse_args(argv)
+
+    import matplotlib
+    matplotlib.use("Agg")
+
+    out_format = os.path.splitext(args.outfile)[1].lstrip(".").lower()
+    plot = IncrementalPlot(args.infile, args.outfile, state_dir=args.state_dir, out_format=out_format)
+    while True:
+        start = time.time()
+        changed = plot.render()
+        sys.stderr.write("%d boxes updated in %.2fs\n" % (len(changed), time.time() - start))
+        if args.watch is None:
+            return 0
+        time.sleep(args.watch)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+Layout engine for the nested box plots.
+
+Computes the x position of every box, the centres of the groups at
+every nesting level (used for the tick labels) and the separators
+between groups, with vectorized arithmetic over the list of box paths.
+Any nesting depth and uneven group sizes are supported; the cost is
+O(number of boxes * depth).
+
+The gap between two consecutive boxes is:
+
+    space_between_clusters             if they belong to different groups
+                                       (a scalar, or one value per level,
+                                       outermost first)
+    space_between_small_and_big_boxes  if one of them is an "All" box
+    space_between_small_boxes          otherwise
+"""
+
+
+import numpy as np
+
+from grouping import iterBoxes
+
+
+def levelChanges(paths):
+
+    """
+    Subroutine for the level at which each box starts a new group
+
+    Returns an array with, for every box after the first, the index of
+    the outermost level whose value differs from the previous box
+    (depth - 1 when only the box itself differs).
+    """
+    depth = len(paths[0])
+    columns = np.empty((len(paths), depth), dtype=object)
+    columns[:] = [tuple(p) for p in paths]
+    changed = columns[1:, :-1] != columns[:-1, :-1]
+    # Boxes in the same innermost group get depth - 1
+    changed = np.concatenate([changed, np.ones((len(paths) - 1, 1), dtype=bool)], axis=1)
+    return np.argmax(changed, axis=1)
+
+
+def nestedLayout(paths, all_label="All", first_small_box_pos=0.75, space_between_small_boxes=0.5,
+                 space_between_small_and_big_boxes=0.25, space_between_clusters=1.25):
+
+    """
+    Lay out boxes given their paths (tuples of level values ending with
+    the box label), in plotting order.
+
+    Returns a dict with
+    positions   x position of every box
+    centres     for every group level (outermost first), the x centre of
+                each group, spanning its first to its last box
+    separators  for every group level, the x positions halfway between
+                consecutive groups
+    """
+    n = len(paths)
+    if not n:
+        return {"positions": np.empty(0), "centres": [], "separators": []}
+    depth = len(paths[0])
+    group_levels = depth - 1
+
+    boundary = levelChanges(paths) if n > 1 else np.empty(0, dtype=np.int64)
+    is_all = np.array([p[-1] == all_label for p in paths])
+    cluster_space = np.broadcast_to(np.asarray(space_between_clusters, dtype=np.float64),
+                                    (max(group_levels, 1),))
+
+    gaps = np.where(is_all[1:] | is_all[:-1], space_between_small_and_big_boxes, space_between_small_boxes)
+    new_group = boundary < group_levels
+    gaps = np.where(new_group, cluster_space[np.minimum(boundary, len(cluster_space) - 1)], gaps)
+    positions = np.cumsum(np.r_[first_small_box_pos, gaps])
+
+    centres = []
+    separators = []
+    for level in range(group_levels):
+        starts = np.r_[0, np.flatnonzero(boundary <= level) + 1]
+        ends = np.r_[starts[1:] - 1, n - 1]
+        centres.append(positions[starts] + (positions[ends] - positions[starts]) / 2)
+        separators.append(positions[ends[:-1]] + (positions[starts[1:]] - positions[ends[:-1]]) / 2)
+
+    return {"positions": positions, "centres": centres, "separators": separators}
+
+
+def boxLayout(mega_data_dict, config):
+
+    """
+    Positions of the boxes, of the tick labels of the outermost groups
+    and of the dotted lines separating them, for a grouped tree
+    """
+    paths = [path for path, box in iterBoxes(mega_data_dict)]
+    layout = nestedLayout(paths, config["spec"]["all_label"],
+                          first_small_box_pos=config["first_small_box_pos"],
+                          space_between_small_boxes=config["space_between_small_boxes"],
+                          space_between_small_and_big_boxes=config["space_between_small_and_big_boxes"],
+                          space_between_clusters=config["space_between_clusters"])
+    if not layout["centres"]:
+        return layout["positions"].tolist(), [], []
+    return layout["positions"].tolist(), layout["centres"][0].tolist(), layout["separators"][0].tolist()
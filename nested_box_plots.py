@@ -1,19 +1,25 @@
 """
 The purpose of this script is to create nested box plots
-to display statistics of a combined dataset in conjunction 
+to display statistics of a combined dataset in conjunction
 with the statistcs of the individual datasets that
 contribute to it.
 
 Command line call:
 python nested_box_plots.py
 
+Several value columns of the input can be plotted from one read of
+the file (metrics configurable), as one plot per column or as stacked
+panels of one figure.
+
+(see batch_render.py to render many input files at once)
+
 Output:
 Image of specified format in specified output directory
 Format is one of the file extensions supported by the
-    active backend. Most backends support png, pdf, 
+    active backend. Most backends support png, pdf,
     ps, eps, and svg file extensions
-    
-Configurables (listed under __main__):
+
+Configurables (DEFAULT_CONFIG; input and output locations under __main__):
 Input and output data and locations
 Figure size
 Plot characteristics including scatter size and transparency,
@@ -27,452 +33,497 @@ Corresponding author for science:
 """
 
 
-import pandas as pd
 import sys
 import os
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-from pylab import setp
+import re
 from collections import OrderedDict
-import math
 
-def setBoxColors(bp, idx, color):
+# pandas, matplotlib and the modules using them are imported where they
+# are first needed, so that a run only pays for the parts it uses (a
+# cached input never loads pandas); render_server.py keeps them loaded
+# between runs
+from grouping import DEFAULT_SPEC
+from profiling import NULL_PROFILER, Profiler
 
-    """
-    Subroutine for setting box plot element colors
-    """
-    setp(bp['boxes'][idx], color=color)
-    setp(bp['caps'][2 * idx], color=color)
-    setp(bp['caps'][2 * idx + 1], color=color)
-    setp(bp['whiskers'][2 * idx], color=color)
-    setp(bp['whiskers'][2 * idx + 1], color=color)
-    setp(bp['medians'][idx], color=color)
 
+"""
+Configurables
 
-if __name__ == "__main__":
+"""
+DEFAULT_CONFIG = OrderedDict([
+    ### Streaming Information ###
+    ("streaming", False), #read the file in chunks into quantile sketches instead of loading it whole
+    ("chunk_rows", 1000000), #rows read per chunk in streaming mode
+    ("rank_error", 0.01), #accuracy bound of the streamed quartiles, as a fraction of the group size
+    ("scatter_sample_size", 2000), #points kept per box for the scatter in streaming mode
+    ("stats_report", True), #write the box statistics (with their rank error) next to the plot
+
+    ### Shard Information ###
+    #the input may be a directory or glob pattern of CSV shards (e.g. one per animal or session), parsed in parallel
+    ("shard_workers", None), #processes parsing the shards, None for one per core
+
+    ### Cache Information ###
+    ("cache_dir", None), #directory caching the parsed and grouped data between runs, None to always re-parse
+    ("value_dtype", None), #NumPy type storing the values (e.g. "float32", "int16"), "auto" for the narrowest type holding them exactly, None to keep the parsed type
+
+    ### Metric Information ###
+    ("metrics", None), #value columns to plot from one read of the file: None for the single non-key column, "all" for every numeric non-key column, or a column name or list of column names
+    ("metric_layout", "figures"), #"figures" saves one plot per value column as <plot name>_<column>.<format>, "panels" stacks them in one figure
+
+    ### Template Information ###
+    ("max_templates", 8), #figure templates kept between renders sharing a templates dict (batch workers, render server); the least recently used are closed
+
+    ### Profiling Information ###
+    ("profile", False), #record time, CPU time, peak memory, rows per group and artist counts of every stage
+    ("profile_format", "chrome"), #"chrome" (a trace for chrome://tracing or Perfetto) or "json", written next to the plot
 
-    """
-    Configurables
-    
-    """
-    
-    ### Data & Output Information ###
-    data_dir = "/home/oco2/heather/liz/data"
-    data_name = "dataforHeather.csv"
-    output_dir = "/home/oco2/heather/liz/output"
-    plot_name = "plot_ex1.png"
-    outfile = os.path.join(output_dir, plot_name)
-    
     ### Plot Infomation ###
-    figsize = (15,5) # (x,y)
-    out_format = "png"
-    
-    transparency_of_scatter = 1 #value between 0 and 1 where 0 is fully transparent and 1 is opaque
-    scatter_size = 22
-    
-    y_axis_name = "# presynaptic structures"
-    yrange = [] #[min,max], script will get it from the data if left empty
-    
-    first_small_box_pos = 0.75
-    space_between_small_boxes = 0.5
-    space_between_small_and_big_boxes = 0.25
-    space_between_clusters = 1.25
-    
-    xtick_fontsize = 15
-    ylabel_fontsize = 15
-    xlabel_fontsize = 15
-    ytick_fontsize = 12       
-    
+    ("figsize", (15,5)), # (x,y)
+    ("out_format", "png"), #or a list of formats, e.g. ["png", "tiff", "pdf"], saved from one drawing as <plot name stem>.<format>
+    ("export_threads", 2), #background threads encoding and writing the files of a list of formats
+    ("dpi", 1000),
+
+    ("rasterize_scatter", True), #draw the scatter as an image inside vector formats (pdf, svg, eps, ps)
+    ("raster_dpi", 300), #resolution of the rasterized scatter in vector formats
+    ("max_pixels", 50000000), #png canvases larger than this are rendered in horizontal strips to bound memory
+    ("strip_rows", 1024), #pixel rows per strip
+
+    ("transparency_of_scatter", 1), #value between 0 and 1 where 0 is fully transparent and 1 is opaque
+    ("scatter_size", 22),
+
+    ("lod_threshold", None), #points per box above which the scatter switches to a level-of-detail mode, None to always draw every point
+    ("lod_mode", "subsample"), #"subsample" draws lod_threshold random points, "density" draws a binned density strip
+    ("scatter_jitter", 0.), #horizontal jitter of the points as a fraction of the box width
+    ("density_bins", 50), #number of bins of the density strips
+
+    ("whis", 1.5), #whisker reach as a multiple of the interquartile range
+    ("notch", False), #draw notches around the medians
+    ("bootstrap", 0), #resamples of bootstrap confidence intervals of the medians (notches, error bars, stats report), 0 for the notch formula
+    ("bootstrap_level", 0.95), #confidence level of the bootstrap intervals
+    ("bootstrap_hierarchical", False), #resample the animals, then their observations, for the "All" boxes
+    ("bootstrap_workers", 1), #processes sharing the resamples
+    ("bootstrap_seed", 0),
+    ("ci_errorbars", False), #draw the median confidence intervals as error bars on the boxes
+
+    ("y_axis_name", "# presynaptic structures"), #or a dict of labels per value column when plotting metrics; columns without a label are labelled with their name
+    ("yrange", []), #[min,max], script will get it from the data if left empty
+
+    ("first_small_box_pos", 0.75),
+    ("space_between_small_boxes", 0.5),
+    ("space_between_small_and_big_boxes", 0.25),
+    ("space_between_clusters", 1.25), #or one value per nesting level, outermost first
+
+    ("xtick_fontsize", 15),
+    ("ylabel_fontsize", 15),
+    ("xlabel_fontsize", 15),
+    ("ytick_fontsize", 12),
+
     #font weight options: 'light', 'normal', 'medium', 'semibold', 'bold', 'heavy', 'black'
-    ylabel_fontweight = 'bold'
-    ytick_fontweight = 'bold'
-    xtick_fontweight = 'bold'
-    
+    ("ylabel_fontweight", 'bold'),
+    ("ytick_fontweight", 'bold'),
+    ("xtick_fontweight", 'bold'),
+
+    ### Hierarchy Information ###
+    #level columns, colour palette and box widths, see grouping.DEFAULT_SPEC
+    ("spec", DEFAULT_SPEC),
+    ])
+
+
+def makeConfig(config=None, **overrides):
+
+    """
+    Subroutine for a full configuration: DEFAULT_CONFIG updated with
+    the given config and keyword overrides
+    """
+    full = OrderedDict(DEFAULT_CONFIG)
+    full.update(config or {})
+    unknown = [k for k in overrides if k not in full]
+    if unknown:
+        raise KeyError("unknown configurable(s): %s" % ", ".join(sorted(unknown)))
+    full.update(overrides)
+    return full
+
+
+def loadData(infile, config, profiler=NULL_PROFILER):
 
     """
-    Prepare Data. 
+    Prepare Data.
 
+    The nested dictionary is built by grouping.groupData from the spec.
     Dictionary variables:
     1) xidx is the position of the center of the box plot and corresponding scatter on the x axis
     2) width is the width of the box plot
     3) color is the hex color of the box and scatter (an rgb tuple or a named Python color would also work here)
     4) data is the data for the given population from the file
+
+    infile may also be a directory or glob pattern of CSV shards (see
+    shards.py); shards are not cached.
     """
-    
-    read_data = pd.read_csv(os.path.join(data_dir, data_name))
-    
-    cols = list(read_data.columns)
-    data_name = list(set(cols) - set(["Animal", "Channel", "Geno"]))[0]
-    
-    number_of_small_boxes = len(set(read_data["Channel"])) * len(set(read_data["Animal"]))
-    number_of_big_boxes = len(set(read_data["Channel"])) * len(set(read_data["Geno"]))
-    total_boxes = number_of_small_boxes + number_of_big_boxes
-    
-    first_big_box_pos = number_of_big_boxes / len(set(read_data["Channel"]))
-    series_addition = total_boxes / number_of_big_boxes
-    idx_big_boxes = [first_big_box_pos + series_addition * n for n in xrange(0, number_of_big_boxes)]
-    idx_big_boxes_plus_one = [i + 1 for i in idx_big_boxes]
-    
-    idx_start_clusters = [series_addition * n for n in xrange(0, number_of_big_boxes)]
-    
-    xidx = [first_small_box_pos] * total_boxes
-    
-
-    for n in xrange(1, len(xidx)):
-        if n in idx_big_boxes or n in idx_big_boxes_plus_one:
-	    xidx[n] = xidx[n-1] + space_between_small_and_big_boxes
-	elif n in idx_start_clusters:
-	    xidx[n] = xidx[n-1] + space_between_clusters
-	else:
-	    xidx[n] = xidx[n-1] + space_between_small_boxes
-
-
-    vertical_lines_positions = []
-    xtick_positions = []
-
-    for i in idx_start_clusters[1::2]:
-	xtick_positions.append(xidx[i - 1] + (xidx[i] - xidx[i-1])/2)
-    for i in idx_start_clusters[2::2]:
-	vertical_lines_positions.append(xidx[i - 1] + (xidx[i] - xidx[i-1])/2)
-    
-    mega_data_dict = OrderedDict([("VGLUT2",
-                                             OrderedDict([("wt", 
-                                                             OrderedDict([("A1",
-		                                                                OrderedDict([("width", 0.2),
-                                                                                            ("color", "#a63603"),
-                                                                                            ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "VGLUT2") & (read_data["Animal"] == 1)]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("A2",
-									        OrderedDict([("width", 0.2),
-                                                                                             ("color", "#e6550d"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "VGLUT2") & (read_data["Animal"] == 2)]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("All",
-									        OrderedDict([("width", 2.),
-                                                                                             ("color", "#000000"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "VGLUT2") & (read_data["Geno"] == "wt")]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("A3",
-									        OrderedDict([("width", 0.2),
-                                                                                             ("color", "#fd8d3c"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "VGLUT2") & (read_data["Animal"] == 3)]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("A4",
-									        OrderedDict([("width", 0.2),
-                                                                                             ("color", "#fdb385"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "VGLUT2") & (read_data["Animal"] == 4)]])),
-                                                                                            ]
-											   )
-									   )
-						                          ]
-									 )
-									 ),
-							
-							("ko", 
-                                                             OrderedDict([("A0",
-		                                                                OrderedDict([("width", 0.2),
-                                                                                            ("color", "#54278f"),
-                                                                                            ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "VGLUT2") & (read_data["Animal"] == 0)]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("A5",
-									        OrderedDict([("width", 0.2),
-                                                                                             ("color", "#756bb1"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "VGLUT2") & (read_data["Animal"] == 5)]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("All",
-									        OrderedDict([("width", 2.),
-                                                                                             ("color", "#000000"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "VGLUT2") & (read_data["Geno"] == "ko")]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("A6",
-									        OrderedDict([("width", 0.2),
-                                                                                             ("color", "#9e9ac8"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "VGLUT2") & (read_data["Animal"] == 6)]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("A7",
-									        OrderedDict([("width", 0.2),
-                                                                                             ("color", "#acbfef"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "VGLUT2") & (read_data["Animal"] == 7)]])),
-                                                                                            ]
-											   )
-									   )
-						                          ])	  
-						             )
-							])		  
-						       ),
-				  ("GlyT2",
-                                             OrderedDict([("wt", 
-                                                             OrderedDict([("A1",
-		                                                                OrderedDict([("width", 0.2),
-                                                                                            ("color", "#a63603"),
-                                                                                            ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GlyT2") & (read_data["Animal"] == 1)]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("A2",
-									        OrderedDict([("width", 0.2),
-                                                                                             ("color", "#e6550d"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GlyT2") & (read_data["Animal"] == 2)]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("All",
-									        OrderedDict([("width", 2.),
-                                                                                             ("color", "#000000"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GlyT2") & (read_data["Geno"] == "wt")]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("A3",
-									        OrderedDict([("width", 0.2),
-                                                                                             ("color", "#fd8d3c"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GlyT2") & (read_data["Animal"] == 3)]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("A4",
-									        OrderedDict([("width", 0.2),
-                                                                                             ("color", "#fdb385"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GlyT2") & (read_data["Animal"] == 4)]])),
-                                                                                            ]
-											   )
-									   )
-						                          ]
-									 )
-									 ),
-							
-							("ko", 
-                                                             OrderedDict([("A0",
-		                                                                OrderedDict([("width", 0.2),
-                                                                                            ("color", "#54278f"),
-                                                                                            ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GlyT2") & (read_data["Animal"] == 0)]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("A5",
-									        OrderedDict([("width", 0.2),
-                                                                                             ("color", "#756bb1"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GlyT2") & (read_data["Animal"] == 5)]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("All",
-									        OrderedDict([("width", 2.),
-                                                                                             ("color", "#000000"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GlyT2") & (read_data["Geno"] == "ko")]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("A6",
-									        OrderedDict([("width", 0.2),
-                                                                                             ("color", "#9e9ac8"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GlyT2") & (read_data["Animal"] == 6)]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("A7",
-									        OrderedDict([("width", 0.2),
-                                                                                             ("color", "#acbfef"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GlyT2") & (read_data["Animal"] == 7)]])),
-                                                                                            ]
-											   )
-									   )
-						                          ])	  
-						             )
-							])		  
-						       ),
-				  ("GAD67",
-                                             OrderedDict([("wt", 
-                                                             OrderedDict([("A1",
-		                                                                OrderedDict([("width", 0.2),
-                                                                                            ("color", "#a63603"),
-                                                                                            ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GAD67") & (read_data["Animal"] == 1)]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("A2",
-									        OrderedDict([("width", 0.2),
-                                                                                             ("color", "#e6550d"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GAD67") & (read_data["Animal"] == 2)]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("All",
-									        OrderedDict([("width", 2.),
-                                                                                             ("color", "#000000"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GAD67") & (read_data["Geno"] == "wt")]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("A3",
-									        OrderedDict([("width", 0.2),
-                                                                                             ("color", "#fd8d3c"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GAD67") & (read_data["Animal"] == 3)]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("A4",
-									        OrderedDict([("width", 0.2),
-                                                                                             ("color", "#fdb385"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GAD67") & (read_data["Animal"] == 4)]])),
-                                                                                            ]
-											   )
-									   )
-						                          ]
-									 )
-									 ),
-							
-							("ko", 
-                                                             OrderedDict([("A0",
-		                                                                OrderedDict([("width", 0.2),
-                                                                                            ("color", "#54278f"),
-                                                                                            ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GAD67") & (read_data["Animal"] == 0)]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("A5",
-									        OrderedDict([("width", 0.2),
-                                                                                             ("color", "#756bb1"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GAD67") & (read_data["Animal"] == 5)]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("All",
-									        OrderedDict([("width", 2.),
-                                                                                             ("color", "#000000"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GAD67") & (read_data["Geno"] == "ko")]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("A6",
-									        OrderedDict([("width", 0.2),
-                                                                                             ("color", "#9e9ac8"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GAD67") & (read_data["Animal"] == 6)]])),
-                                                                                            ]
-											   )
-									   ),
-									   ("A7",
-									        OrderedDict([("width", 0.2),
-                                                                                             ("color", "#acbfef"),
-                                                                                             ("data", list(read_data[data_name][read_data.index[(read_data["Channel"] == "GAD67") & (read_data["Animal"] == 7)]])),
-                                                                                            ]
-											   )
-									   )
-						                          ])	  
-						             )
-							])		  
-						       ),
-				 ]
-				)
-    
-    
-
-    """
-    Iterate over dictionary to get all the box plot info ready
-    """
-    data_to_plot = []
-    color_of_plot = []
-    widths = []
-    xlabels = list(set(read_data["Channel"]))
-    
-    vertical_lines_ymin = 1000000.
-    vertical_lines_ymax = -999999.
-    
-    for channel in xlabels:
-	for geno in mega_data_dict[channel].keys():
-            for animal in mega_data_dict[channel][geno].keys():
-		data_to_plot.append(mega_data_dict[channel][geno][animal]["data"])
-		vertical_lines_ymax = max(vertical_lines_ymax, max(mega_data_dict[channel][geno][animal]["data"]))
-		vertical_lines_ymin = min(vertical_lines_ymin, min(mega_data_dict[channel][geno][animal]["data"]))
-		color_of_plot.append(mega_data_dict[channel][geno][animal]["color"])
-		widths.append(mega_data_dict[channel][geno][animal]["width"])
-    
-    vertical_lines_ymin = min(0, math.floor(vertical_lines_ymin))
-    vertical_lines_ymax = math.ceil(vertical_lines_ymax)
-    
-    
-    """
-    Plot the box plots
-    """
-
-    fig = plt.figure(figsize=figsize)
-    ax = plt.subplot(111)
-
-    bp = ax.boxplot(data_to_plot, positions=xidx, widths=widths)
-    
-    
-    """
-    Set colors of box plots
-    """
-    for idx, color in enumerate(color_of_plot):
-	setBoxColors(bp, idx, color)
-
-    
-    """
-    Iterate over the dictionary again to do the scatter plots
-    """
-    cnt = 0
-    for channel in xlabels:
-	for geno in mega_data_dict[channel].keys():
-            for animal in mega_data_dict[channel][geno].keys():
-		if animal == "All":
-		    #Skip scatter for the full channel + geno boxes
-		    cnt += 1
-	            continue
-		y = mega_data_dict[channel][geno][animal]["data"]
-		x = [xidx[cnt]] * len(y)
-		color = mega_data_dict[channel][geno][animal]["color"]
-		ax.scatter(x, y, c=color, edgecolor="None", alpha=transparency_of_scatter, s=scatter_size)
-		cnt += 1
-
-    
-    """
-    Set other plot parameters
-    """
-    
-    if not yrange or len(yrange) != 2:
-        ymin = vertical_lines_ymin
-	ymax = vertical_lines_ymax
-    else:
-        ymin = yrange[0]
-	ymax = yrange[1]
-    ax.vlines(vertical_lines_positions, ymin, ymax, linestyle='dotted')
-    mpl.rcParams['font.sans-serif']='Arial'
-    
-    ax.set_ylabel(y_axis_name, fontweight=ylabel_fontweight, fontsize=ylabel_fontsize)
-    for t in ax.get_yticklabels():
-        t.set_weight(ytick_fontweight)
-	t.set_fontsize(ytick_fontsize)
-    
-    ax.set_xlabel("")
-    plt.xticks(xtick_positions, xlabels)
-    for t in ax.get_xticklabels():
-        t.set_weight(xtick_fontweight)
-	t.set_fontsize(xtick_fontsize)    
-    
+    from shards import isSharded
+
+    spec = config["spec"]
+    if isSharded(infile):
+        return loadShards(infile, config, profiler)[None]
+    if config["streaming"]:
+        from streaming import streamData
+
+        with profiler.stage("stream"):
+            return streamData(infile, spec=spec, chunk_rows=config["chunk_rows"],
+                              rank_error=config["rank_error"], sample_size=config["scatter_sample_size"])
+    if config["cache_dir"]:
+        from cache import cachedData
+
+        with profiler.stage("cache"):
+            return cachedData(infile, config["cache_dir"], spec, config["value_dtype"])
+    import pandas as pd
+    from grouping import getValueColumn, groupData
+
+    with profiler.stage("read"):
+        read_data = pd.read_csv(infile)
+        profiler.count(rows=len(read_data))
+    with profiler.stage("grouping"):
+        data_name = getValueColumn(read_data, spec)
+        return groupData(read_data, data_name, spec, config["value_dtype"])
+
+
+def loadMetrics(infile, config, profiler=NULL_PROFILER):
+
+    """
+    Prepare the data of every value column selected by the metrics
+    configurable from one read of infile: an OrderedDict of nested
+    dictionaries (see loadData) keyed by column name, with the same boxes
+    """
+    from shards import isSharded
+
+    spec = config["spec"]
+    if config["streaming"]:
+        raise ValueError("the metrics configurable is not supported in streaming mode")
+    if isSharded(infile):
+        return loadShards(infile, config, profiler)
+    if config["cache_dir"]:
+        from cache import cachedMetrics
+
+        with profiler.stage("cache"):
+            return cachedMetrics(infile, config["cache_dir"], spec, config["value_dtype"], config["metrics"])
+    import pandas as pd
+    from grouping import metricsData
+
+    with profiler.stage("read"):
+        read_data = pd.read_csv(infile)
+        profiler.count(rows=len(read_data))
+    with profiler.stage("grouping"):
+        return metricsData(read_data, config["metrics"], spec, config["value_dtype"])
+
+
+def loadShards(infile, config, profiler=NULL_PROFILER):
+
+    """
+    Prepare the data of the CSV shards of a directory or glob pattern,
+    parsed in parallel (see shards.py): an OrderedDict of nested
+    dictionaries keyed by value column, or under None for the single
+    value column without the metrics configurable
+    """
+    from grouping import columnsTree, metricTrees
+    from shards import shardFiles, shardedColumns, shardedSummaries
+
+    spec = config["spec"]
+    with profiler.stage("shards", shards=len(shardFiles(infile)), workers=config["shard_workers"]):
+        if config["streaming"]:
+            from streaming import summaryTree
+
+            summaries = shardedSummaries(infile, spec, chunk_rows=config["chunk_rows"],
+                                         rank_error=config["rank_error"],
+                                         sample_size=config["scatter_sample_size"], workers=config["shard_workers"])
+            return OrderedDict([(None, summaryTree(summaries, spec))])
+        columns, offsets, leaf_keys = shardedColumns(infile, spec, config["metrics"], config["value_dtype"],
+                                                     config["shard_workers"])
+        profiler.count(rows=int(offsets[-1]))
+        if config["metrics"] is None:
+            return OrderedDict([(None, columnsTree(list(columns.values())[0], offsets, leaf_keys, spec))])
+        return metricTrees(columns, offsets, leaf_keys, spec)
+
+
+def metricConfig(config, data_name):
+
+    """
+    Subroutine for the configuration of the plot of one value column,
+    labelled with its entry of a y_axis_name dict or with its name
+    """
+    labels = config["y_axis_name"]
+    metric_config = OrderedDict(config)
+    metric_config["y_axis_name"] = labels.get(data_name, data_name) if isinstance(labels, dict) else data_name
+    return metric_config
+
+
+def metricFile(outfile, data_name):
+
+    """
+    Subroutine for the output file of one value column: <stem>_<column><extension>
+    """
+    stem, extension = os.path.splitext(outfile)
+    return "%s_%s%s" % (stem, re.sub(r"[^\w.-]+", "_", str(data_name)), extension)
+
+
+def drawPlot(mega_data_dict, config, profiler=NULL_PROFILER, stats=None):
+
+    """
+    Draw the nested box plots of a grouped tree into a new figure
+    template, with its box statistics when already computed
+    """
+    from layout import boxLayout
+    from template import FigureTemplate
+
+    with profiler.stage("layout"):
+        positions = boxLayout(mega_data_dict, config)
+    return FigureTemplate(mega_data_dict, config, positions, profiler, stats)
+
+
+def drawPanels(trees, stats, config, profiler=NULL_PROFILER):
+
+    """
+    Draw the nested box plots of several value columns (see loadMetrics)
+    as panels stacked in one figure, each figsize high, sharing the box
+    layout. Returns the figure template of every panel.
+    """
+    import matplotlib.pyplot as plt
+    from layout import boxLayout
+    from template import FigureTemplate
+
+    first = list(trees.values())[0]
+    with profiler.stage("layout"):
+        positions = boxLayout(first, config)
+    width, height = config["figsize"]
+    fig = plt.figure(figsize=(width, height * len(trees)))
+    axes = fig.subplots(len(trees), 1, sharex=True, squeeze=False)[:, 0]
+    return [FigureTemplate(tree, metricConfig(config, name), positions, profiler, stats[name], ax)
+            for (name, tree), ax in zip(trees.items(), axes)]
+
+
+def layoutKey(mega_data_dict, config):
+
+    """
+    Subroutine for the key under which a figure template can be reused:
+    the boxes of the tree and the configuration
+    """
+    from template import layoutPaths
+
+    return (layoutPaths(mega_data_dict), repr(list(config.items())))
+
+
+def renderPlot(infile, outfile, config=None, templates=None, **overrides):
+
+    """
+    Read infile, draw its nested box plots and save them to outfile.
+    Returns outfile.
+
+    templates is an optional dict in which the figure templates are kept
+    between calls: data with the same boxes and configuration is then
+    pushed into the existing figure instead of building a new one. At
+    most max_templates templates are kept; the least recently used are
+    closed.
+
+    With the profile configurable, a trace of the stages is written to
+    <outfile stem>_profile.json (see profiling.py). When plotting several
+    value columns (metrics configurable) as separate figures, each plot
+    and its statistics are written next to outfile under the name of
+    the column (see metricFile).
+
+    A list of formats (out_format configurable) is saved by an
+    output.Exporter; the timing of every format is written to
+    <outfile stem>_export.txt and added to the profile. The files are
+    written when renderPlot returns; see startRender to go on with the
+    next figure while they are encoded.
+    """
+    return startRender(infile, outfile, config, templates, **overrides)()
+
+
+def startRender(infile, outfile, config=None, templates=None, exporter=None, **overrides):
+
+    """
+    Render infile to outfile as renderPlot does, up to the output files
+    of a list of formats, and return a function finishing the render:
+    it waits for those files, writes their timing and the profile, and
+    returns outfile.
+
+    exporter is an output.Exporter kept by the caller (and closed by
+    it) for its renders. The files of a list of formats are then encoded
+    and written in its background threads after startRender returns, so
+    the caller can prepare its next figure before finishing this one.
+    Without it, an exporter of this render is closed by the function.
+    """
+    config = makeConfig(config, **overrides)
+    profiler = Profiler() if config["profile"] else NULL_PROFILER
+    own = None
+    if not isinstance(config["out_format"], (list, tuple)):
+        exporter = None
+    elif exporter is None:
+        from output import Exporter
+
+        own = exporter = Exporter(config["export_threads"])
+    try:
+        with profiler.stage("render", infile=infile, outfile=outfile):
+            renderStages(infile, outfile, config, templates, profiler, exporter)
+    except Exception:
+        if own is not None:
+            own.close()
+        elif exporter is not None:
+            # The files of the failed render are left out of the next ones
+            exporter.detach()
+        raise
+    pending = exporter.detach() if exporter is not None else None
+
+    def finish():
+        try:
+            if pending is not None:
+                with profiler.stage("export_wait"):
+                    exports = exporter.collect(pending)
+                exportTimes(outfile, exports, profiler)
+        finally:
+            if own is not None:
+                own.close()
+        if profiler.enabled:
+            profiler.write(os.path.splitext(outfile)[0] + "_profile.json", config["profile_format"])
+        return outfile
+
+    return finish
+
+
+def exportTimes(outfile, exports, profiler):
+
+    """
+    Subroutine for reporting the per-format timing of the files of an
+    output.Exporter next to the plot and in the profile, where the
+    background work of every file is a span on its own row of the trace
+    """
+    from output import exportReport
+
+    with open(os.path.splitext(outfile)[0] + "_export.txt", "w") as report:
+        report.write(exportReport(exports))
+    for n, record in enumerate(exports):
+        profiler.span("export_%s" % record["format"], record["background_start"], record["encode"] + record["write"],
+                      thread=n + 1, path=record["path"], bytes=record["bytes"])
+    profiler.count(exports=[OrderedDict((k, v) for k, v in record.items() if k not in ("start", "background_start"))
+                            for record in exports])
+
+
+def renderStages(infile, outfile, config, templates, profiler, exporter=None):
+
+    """
+    Subroutine for the stages of renderPlot
+    """
+    if config["metrics"] is not None:
+        return renderMetrics(infile, outfile, config, templates, profiler, exporter)
+
+    mega_data_dict = loadData(infile, config, profiler)
+    profiler.groups(mega_data_dict)
+    template = plotTemplate(mega_data_dict, config, templates, profiler)
+    writeStats(outfile, mega_data_dict, template.stats, config, profiler)
+
     """
     Display the plot
     """
     #plt.show()
-    
-    
+
+
     """
     Save the plot
     """
-    plt.savefig(outfile, format=out_format, dpi=1000)
+    saveTemplate(template, outfile, templates, exporter)
+
+
+def renderMetrics(infile, outfile, config, templates, profiler, exporter=None):
+
+    """
+    Subroutine for the stages of renderPlot for several value columns:
+    one read and grouping pass, one statistics pass, then one plot per
+    column or one figure of stacked panels
+    """
+    from template import metricsStats
+
+    trees = loadMetrics(infile, config, profiler)
+    profiler.groups(list(trees.values())[0])
+    with profiler.stage("stats", metrics=len(trees)):
+        stats = metricsStats(trees, config)
+    for name, tree in trees.items():
+        writeStats(metricFile(outfile, name), tree, stats[name], config, profiler)
+
+    if config["metric_layout"] == "panels":
+        panels = drawPanels(trees, stats, config, profiler)
+        saveTemplate(panels[0], outfile, None, exporter)
+    else:
+        for name, tree in trees.items():
+            template = plotTemplate(tree, metricConfig(config, name), templates, profiler, stats[name])
+            saveTemplate(template, metricFile(outfile, name), templates, exporter)
+
+
+def plotTemplate(mega_data_dict, config, templates, profiler, stats=None):
+
+    """
+    Subroutine for the figure template of a tree: the one kept in
+    templates for its layout, updated with the data, or a new one
+
+    templates keeps the max_templates most recently used templates, in
+    order of use; the figures of the templates dropped are closed.
+    """
+    if templates is None:
+        return drawPlot(mega_data_dict, config, profiler, stats)
+    key = layoutKey(mega_data_dict, config)
+    template = templates.pop(key, None)
+    if template is None:
+        template = drawPlot(mega_data_dict, config, profiler, stats)
+    else:
+        template.profiler = profiler
+        template.update(mega_data_dict, stats)
+    templates[key] = template
+    while len(templates) > max(1, config["max_templates"]):
+        templates.pop(next(iter(templates))).close()
+    return template
+
+
+def writeStats(outfile, mega_data_dict, stats, config, profiler):
+
+    """
+    Subroutine for writing the box statistics next to the plot
+    """
+    from box_stats import statsReport
+
+    if config["stats_report"]:
+        with profiler.stage("stats_report"):
+            with open(os.path.splitext(outfile)[0] + "_stats.txt", "w") as report:
+                report.write(statsReport(mega_data_dict, stats))
+
+
+def saveTemplate(template, outfile, templates, exporter=None):
+
+    """
+    Subroutine for saving the figure of a template, then closing it
+    unless it is kept in templates
+    """
+    try:
+        template.save(outfile, exporter)
+    finally:
+        if templates is None:
+            template.close()
+        else:
+            template.profiler = NULL_PROFILER
+
+
+if __name__ == "__main__":
+
+    """
+    Configurables
+
+    """
+
+    ### Data & Output Information ###
+    data_dir = "/home/oco2/heather/liz/data"
+    data_name = "dataforHeather.csv"
+    output_dir = "/home/oco2/heather/liz/output"
+    plot_name = "plot_ex1.png"
+    outfile = os.path.join(output_dir, plot_name)
+
+    ### Plot Information ###
+    #any entry of DEFAULT_CONFIG can be overridden here, e.g. scatter_size=10
+    config = makeConfig()
+
+    renderPlot(os.path.join(data_dir, data_name), outfile, config)
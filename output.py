@@ -0,0 +1,276 @@
+"""
+Output stage for the nested box plots.
+
+Vector formats (pdf, svg, eps, ps) keep boxes, text and lines as
+vectors while the dense scatter layer is rasterized at its own,
+lower dpi, so the files do not hold one primitive per data point.
+
+Large PNG targets are rendered in horizontal strips: each strip is
+drawn by Agg on its own small canvas and its rows are streamed into a
+zlib-compressed PNG, so peak memory is bounded by the strip size
+instead of the full width x height x 4 byte canvas.
+
+An Exporter saves a figure in several formats at once: the canvas is
+drawn once for all raster formats, which are encoded from the same
+RGBA buffer, and the vector formats are rendered into memory. Encoding
+and writing the files is left to background threads, so the caller can
+go on with the next figure meanwhile; the drawing itself stays on the
+calling thread, as matplotlib figures are not thread-safe.
+"""
+
+
+import io
+import os
+import struct
+import time
+import zlib
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+from matplotlib.transforms import Bbox
+
+
+VECTOR_FORMATS = ("pdf", "svg", "svgz", "eps", "ps")
+
+# Raster formats encoded from an RGBA buffer by matplotlib.image.imsave
+BUFFER_FORMATS = ("png", "tif", "tiff", "jpg", "jpeg", "webp")
+
+
+def rasterizeArtists(artists):
+
+    """
+    Subroutine for marking artists to be rasterized in vector output
+    """
+    for artist in artists:
+        artist.set_rasterized(True)
+
+
+def canvasSize(fig, dpi):
+
+    """
+    Subroutine for the pixel size (width, height) of the figure at dpi
+    """
+    width, height = fig.get_size_inches()
+    return int(round(width * dpi)), int(round(height * dpi))
+
+
+def renderStrip(fig, dpi, top, rows):
+
+    """
+    Render the horizontal band of the figure that starts top pixel rows
+    below its upper edge and is rows pixels high, as an RGBA array
+    """
+    width, height = fig.get_size_inches()
+    y1 = height - float(top) / dpi
+    y0 = max(0., y1 - float(rows) / dpi)
+    stream = io.BytesIO()
+    fig.savefig(stream, format="raw", dpi=dpi, bbox_inches=Bbox([[0., y0], [width, y1]]))
+    return np.frombuffer(stream.getvalue(), dtype=np.uint8).reshape(-1, canvasSize(fig, dpi)[0], 4)
+
+
+def pngChunk(tag, data):
+
+    """
+    Subroutine for one length/tag/data/crc PNG chunk
+    """
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+
+def saveTiledPng(fig, outfile, dpi, strip_rows=1024):
+
+    """
+    Save the figure as an RGBA PNG rendered strip by strip.
+
+    Only one strip of strip_rows rows is held in memory at a time;
+    its rows are compressed and written before the next is drawn.
+    """
+    width, height = canvasSize(fig, dpi)
+    ppm = int(round(dpi / 0.0254))
+    compressor = zlib.compressobj(6)
+    with open(outfile, "wb") as out:
+        out.write(b"\x89PNG\r\n\x1a\n")
+        out.write(pngChunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)))
+        out.write(pngChunk(b"pHYs", struct.pack(">IIB", ppm, ppm, 1)))
+        top = 0
+        while top < height:
+            strip = renderStrip(fig, dpi, top, min(strip_rows, height - top))[:height - top]
+            if not len(strip):
+                break
+            # Each scanline is prefixed with filter type 0 (none)
+            lines = np.concatenate([np.zeros((len(strip), 1), dtype=np.uint8),
+                                    strip.reshape(len(strip), -1)], axis=1)
+            data = compressor.compress(lines.tobytes())
+            if data:
+                out.write(pngChunk(b"IDAT", data))
+            top += len(strip)
+        out.write(pngChunk(b"IDAT", compressor.flush()))
+        out.write(pngChunk(b"IEND", b""))
+
+
+def savePlot(fig, outfile, out_format, dpi=1000, raster_dpi=300, max_pixels=50000000, strip_rows=1024):
+
+    """
+    Save the figure in the given format.
+
+    Vector formats are written with the rasterized layers at raster_dpi;
+    PNG canvases above max_pixels pixels are rendered in strips.
+    """
+    width, height = canvasSize(fig, dpi)
+    if out_format in VECTOR_FORMATS:
+        fig.savefig(outfile, format=out_format, dpi=raster_dpi)
+    elif out_format == "png" and max_pixels is not None and width * height > max_pixels:
+        saveTiledPng(fig, outfile, dpi, strip_rows=strip_rows)
+    else:
+        fig.savefig(outfile, format=out_format, dpi=dpi)
+
+
+def outputFiles(outfile, out_format):
+
+    """
+    Subroutine for the (format, path) pairs to save: outfile in out_format,
+    or <outfile stem>.<format> for each of a list of formats
+    """
+    if not isinstance(out_format, (list, tuple)):
+        return [(out_format, outfile)]
+    stem = os.path.splitext(outfile)[0]
+    return [(out_format_, "%s.%s" % (stem, out_format_)) for out_format_ in out_format]
+
+
+def renderBuffer(fig, dpi):
+
+    """
+    Subroutine for drawing the figure once at dpi, as an RGBA array
+    """
+    stream = io.BytesIO()
+    fig.savefig(stream, format="rgba", dpi=dpi)
+    width, height = canvasSize(fig, dpi)
+    return np.frombuffer(stream.getvalue(), dtype=np.uint8).reshape(height, width, 4)
+
+
+def encodeBuffer(rgba, path, out_format, dpi):
+
+    """
+    Subroutine for encoding an RGBA array in a raster format and writing it to path.
+    Returns (start, encode seconds, write seconds, bytes).
+    """
+    from matplotlib.image import imsave
+
+    start = time.time()
+    stream = io.BytesIO()
+    imsave(stream, rgba, format=out_format, dpi=dpi)
+    encoded = time.time()
+    return (start, encoded - start) + writeBytes(stream.getvalue(), path)[2:]
+
+
+def writeBytes(data, path):
+
+    """
+    Subroutine for writing an encoded file to path.
+    Returns (start, encode seconds, write seconds, bytes), encoding taking none.
+    """
+    start = time.time()
+    with open(path, "wb") as stream:
+        stream.write(data)
+    return start, 0., time.time() - start, len(data)
+
+
+def exportReport(records):
+
+    """
+    Subroutine for a tab-separated table of the timing of the files of
+    Exporter.wait, one line per file
+    """
+    lines = ["\t".join(["format", "path", "draw_s", "encode_s", "write_s", "bytes"])]
+    for record in records:
+        lines.append("\t".join([record["format"], record["path"]] +
+                               ["%.6f" % record[k] for k in ("draw", "encode", "write")] + ["%d" % record["bytes"]]))
+    return "\n".join(lines) + "\n"
+
+
+class Exporter(object):
+
+    """
+    Output of figures in several formats, finished in background threads
+    """
+
+    def __init__(self, threads=2):
+        self.pool = ThreadPool(max(1, threads))
+        self.pending = []
+
+    def save(self, fig, outfiles, dpi=1000, raster_dpi=300, max_pixels=50000000, strip_rows=1024):
+
+        """
+        Save the figure to outfiles, a list of (format, path) pairs (see
+        outputFiles), as savePlot would. Returns once the figure has been
+        drawn; the files are encoded and written in the background (see wait).
+
+        Raster formats are encoded from one drawing of the canvas, except
+        PNG canvases above max_pixels, which are rendered in strips, and
+        formats matplotlib.image.imsave does not write.
+        """
+        width, height = canvasSize(fig, dpi)
+        tiled = max_pixels is not None and width * height > max_pixels
+        buffered = [(f, p) for f, p in outfiles if f in BUFFER_FORMATS and not (tiled and f == "png")]
+        if buffered:
+            start = time.time()
+            # The buffer is a copy of the canvas, safe to encode while the figure changes
+            rgba = renderBuffer(fig, dpi)
+            drawn = time.time() - start
+            for out_format, path in buffered:
+                self.pending.append((out_format, path, start, drawn,
+                                     self.pool.apply_async(encodeBuffer, (rgba, path, out_format, dpi))))
+
+        for out_format, path in outfiles:
+            if (out_format, path) in buffered:
+                continue
+            start = time.time()
+            if out_format in VECTOR_FORMATS:
+                stream = io.BytesIO()
+                fig.savefig(stream, format=out_format, dpi=raster_dpi)
+                result = self.pool.apply_async(writeBytes, (stream.getvalue(), path))
+            else:
+                # Drawn, encoded and written here
+                savePlot(fig, path, out_format, dpi=dpi, raster_dpi=raster_dpi, max_pixels=max_pixels,
+                         strip_rows=strip_rows)
+                result = (time.time(), 0., 0., os.path.getsize(path))
+            self.pending.append((out_format, path, start, time.time() - start, result))
+
+    def wait(self):
+
+        """
+        Wait for the files saved so far.
+        Returns one record per file (see collect).
+        """
+        return self.collect(self.detach())
+
+    def detach(self):
+
+        """
+        Take the files saved so far out of the exporter, for collect;
+        they go on being finished in the background, and later calls of
+        wait only cover the files saved afterwards
+        """
+        pending, self.pending = self.pending, []
+        return pending
+
+    def collect(self, pending):
+
+        """
+        Wait for the files of detach.
+        Returns one record per file: format, path, the time.time() stamp
+        and seconds of drawing on the calling thread (shared by the raster
+        formats of one figure), the time.time() stamp and seconds of
+        encoding and writing in the background, and the size in bytes.
+        """
+        records = []
+        for out_format, path, start, drawn, result in pending:
+            background_start, encode, write, size = result if isinstance(result, tuple) else result.get()
+            records.append(OrderedDict([("format", out_format), ("path", path), ("start", start), ("draw", drawn),
+                                        ("background_start", background_start), ("encode", encode),
+                                        ("write", write), ("bytes", size)]))
+        return records
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
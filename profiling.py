@@ -0,0 +1,253 @@
+"""
+Instrumentation of the stages of a render.
+
+A Profiler records, for every stage run inside profiler.stage(name),
+the wall time, the CPU time of the process, the resident set size at
+the start and end of the stage, the peak resident set size reached
+during the stage and any counts attached to the stage (rows per group,
+artists drawn, ...). Stages may nest.
+
+The peak of a stage is the high-water mark of the process (VmHWM),
+reset at the start of the stage through /proc/self/clear_refs on
+Linux. Where it cannot be reset, the peak of the stage is unknown
+(None) and process_peak_rss, the peak over the lifetime of the process
+(ru_maxrss), is recorded instead.
+Work timed elsewhere, such as the output files encoded and written in
+background threads (see output.Exporter), is added with profiler.span.
+The record is written either as plain JSON or as a Chrome trace (Trace
+Event Format), which chrome://tracing, Perfetto and speedscope load
+directly.
+
+NULL_PROFILER has the same interface and records nothing, so the
+pipeline is instrumented unconditionally and costs nothing when
+profiling is off (the "profile" configurable).
+"""
+
+
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where the peak RSS is not recorded
+    resource = None
+
+
+cpuTime = getattr(time, "process_time", None) or time.clock
+
+
+def processPeakRss():
+
+    """
+    Subroutine for the peak resident set size over the lifetime of the process in bytes, or None
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def procStatus(field):
+
+    """
+    Subroutine for a memory field of /proc/self/status (VmRSS, VmHWM) in bytes, or None
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def currentRss():
+
+    """
+    Subroutine for the current resident set size of the process in bytes, or None
+    """
+    return procStatus("VmRSS")
+
+
+def peakRss():
+
+    """
+    Subroutine for the resident set size high-water mark of the process
+    in bytes (since the last resetPeakRss), or None
+    """
+    return procStatus("VmHWM")
+
+
+def resetPeakRss():
+
+    """
+    Subroutine for resetting the high-water mark of peakRss to the
+    current resident set size; returns whether it could be reset
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except (IOError, OSError):
+        return False
+    return peakRss() is not None
+
+
+class Profiler(object):
+
+    """
+    Record of the stages of a render
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.origin = time.time()
+        self.stages = []
+        self.counts = OrderedDict()
+
+    @contextmanager
+    def stage(self, name, **counts):
+
+        """
+        Time the body of the with statement as the stage name; counts
+        (and any added with count() while the stage runs) are kept with it
+        """
+        record = OrderedDict([("name", name), ("depth", len(self.openStages()))])
+        record["start"] = time.time() - self.origin
+        record["counts"] = OrderedDict(counts)
+        # Resetting the high-water mark would hide the peak so far from
+        # the stages this one is nested in, so they keep it
+        running = self.openStages()
+        peak = peakRss()
+        for outer in running:
+            if outer["peak_rss"] is not None:
+                outer["peak_rss"] = max(outer["peak_rss"], peak)
+        resettable = resetPeakRss()
+        record["rss_start"] = currentRss()
+        record["peak_rss"] = record["rss_start"] if resettable else None
+        record["open"] = True
+        self.stages.append(record)
+        cpu = cpuTime()
+        try:
+            yield record
+        finally:
+            record["wall"] = time.time() - self.origin - record["start"]
+            record["cpu"] = cpuTime() - cpu
+            record["rss_end"] = currentRss()
+            if record["peak_rss"] is not None:
+                record["peak_rss"] = max(record["peak_rss"], peakRss())
+                record["process_peak_rss"] = None
+            else:
+                record["process_peak_rss"] = processPeakRss()
+            del record["open"]
+
+    def span(self, name, start, wall, thread=0, **counts):
+
+        """
+        Record work timed elsewhere as a finished stage; start is a
+        time.time() stamp and thread the row of the trace showing it
+        """
+        self.stages.append(OrderedDict([("name", name), ("depth", 0), ("start", start - self.origin),
+                                        ("counts", OrderedDict(counts)), ("wall", wall), ("cpu", None),
+                                        ("rss_start", None), ("peak_rss", None), ("rss_end", None),
+                                        ("process_peak_rss", None), ("thread", thread)]))
+
+    def openStages(self):
+        return [s for s in self.stages if "open" in s]
+
+    def count(self, **counts):
+
+        """
+        Attach counts to the innermost running stage, or to the whole render outside of stages
+        """
+        running = self.openStages()
+        (running[-1]["counts"] if running else self.counts).update(counts)
+
+    def groups(self, mega_data_dict):
+
+        """
+        Attach the number of rows of every box of a grouped tree to the whole render
+        """
+        from grouping import iterBoxes
+
+        rows = OrderedDict()
+        for path, box in iterBoxes(mega_data_dict):
+            sketch = box.get("sketch")
+            rows["/".join(str(p) for p in path)] = int(sketch.count if sketch is not None else len(box["data"]))
+        self.counts["rows_per_group"] = rows
+
+    def report(self):
+
+        """
+        The record as a JSON-serializable dict
+        """
+        return OrderedDict([("stages", self.stages), ("counts", self.counts)])
+
+    def chromeTrace(self):
+
+        """
+        The record as a Chrome trace: one complete ("X") event per stage
+        and "rss" counter ("C") events with the resident set size at the
+        start and end of each stage
+        """
+        pid = os.getpid()
+        events = []
+        for record in self.stages:
+            args = OrderedDict()
+            if record["cpu"] is not None:
+                args["cpu_ms"] = record["cpu"] * 1e3
+            for key in ("rss_start", "peak_rss", "rss_end", "process_peak_rss"):
+                args[key] = record[key]
+            if record["peak_rss"] is not None and record["rss_start"] is not None:
+                args["peak_rss_delta"] = record["peak_rss"] - record["rss_start"]
+            args.update(record["counts"])
+            events.append({"name": record["name"], "cat": "render", "ph": "X", "pid": pid,
+                           "tid": record.get("thread", 0),
+                           "ts": record["start"] * 1e6, "dur": record["wall"] * 1e6, "args": args})
+            for ts, key in ((record["start"], "rss_start"), (record["start"] + record["wall"], "rss_end")):
+                if record[key] is not None:
+                    events.append({"name": "rss", "ph": "C", "pid": pid, "tid": 0, "ts": ts * 1e6,
+                                   "args": {"bytes": record[key]}})
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": self.counts}
+
+    def write(self, path, trace_format="chrome"):
+
+        """
+        Write the record to path, as a Chrome trace ("chrome") or plain JSON ("json")
+        """
+        if trace_format not in ("chrome", "json"):
+            raise ValueError("unknown trace format %r, use 'chrome' or 'json'" % trace_format)
+        with open(path, "w") as stream:
+            json.dump(self.chromeTrace() if trace_format == "chrome" else self.report(), stream, indent=1)
+
+
+class NullProfiler(object):
+
+    """
+    Profiler interface that records nothing
+    """
+
+    enabled = False
+
+    @contextmanager
+    def stage(self, name, **counts):
+        yield None
+
+    def span(self, name, start, wall, thread=0, **counts):
+        pass
+
+    def count(self, **counts):
+        pass
+
+    def groups(self, mega_data_dict):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
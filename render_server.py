@@ -0,0 +1,320 @@
+"""
+Long-running render service for the nested box plots.
+
+Importing pandas and matplotlib and loading the fonts costs more than
+rendering a small figure. The server pays for it once, keeps a warm
+Agg backend and the figure templates of previous jobs (see
+template.py), and renders jobs sent to it over localhost HTTP or a
+Unix socket.
+
+Command line call:
+python render_server.py serve --socket /tmp/nested_box_plots.sock
+python render_server.py render data.csv plot.png --socket /tmp/nested_box_plots.sock --set dpi=300
+python render_server.py render data.csv --format svg --bytes --port 8765 > plot.svg
+
+Protocol (HTTP/1.0, JSON):
+POST /render   {"input": path, "output": path or null, "config": {configurable: value},
+                "bytes": false}
+               Renders input with nested_box_plots.renderPlot and the
+               config overrides. Returns {"output": path, "seconds": s};
+               with "bytes" (or without an output path) the image itself
+               is returned and nothing is kept on the server. A list
+               out_format needs an output path.
+               Errors return status 500 and {"error": traceback}.
+GET  /status   {"pid", "jobs", "uptime", "templates"}
+
+Jobs are rendered one at a time (pyplot is not thread-safe); paths are
+read and written by the server process, so relative paths are resolved
+by the client. The TCP server only listens on 127.0.0.1.
+"""
+
+
+import argparse
+import json
+import mimetypes
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+import traceback
+from collections import OrderedDict
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import UnixStreamServer
+    import http.client as httplib
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import UnixStreamServer
+    import httplib
+
+from batch_render import parseOverrides, useAgg
+
+
+DEFAULT_PORT = 8765
+
+
+def warmUp():
+
+    """
+    Subroutine for loading the libraries and the Agg font machinery ahead of the first job
+    """
+    useAgg()
+    import pandas
+    import matplotlib.pyplot as plt
+    import nested_box_plots, streaming, cache, layout, template
+
+    fig = plt.figure()
+    fig.text(0.5, 0.5, "warm-up", fontweight="bold")
+    fig.canvas.draw()
+    plt.close(fig)
+
+
+def renderRequest(job, templates, exporter=None):
+
+    """
+    Render one job (see the protocol above), saving lists of formats
+    through the exporter of the server; the files are written before it
+    returns, as the response reports them.
+    Returns (output path, temporary directory or None).
+    """
+    from nested_box_plots import startRender
+
+    overrides = dict(job.get("config") or {})
+    if "figsize" in overrides:
+        overrides["figsize"] = tuple(overrides["figsize"])
+    outfile = job.get("output")
+    tmp = None
+    if outfile:
+        # The output extension decides the format, unless a list of
+        # formats is saved next to it
+        if not isinstance(overrides.get("out_format"), (list, tuple)):
+            overrides["out_format"] = os.path.splitext(outfile)[1].lstrip(".").lower()
+    elif isinstance(overrides.get("out_format"), (list, tuple)):
+        raise ValueError("a list of formats needs an output path; only one image is returned as bytes")
+    else:
+        tmp = tempfile.mkdtemp(prefix="nested_box_plots_")
+        outfile = os.path.join(tmp, "plot.%s" % overrides.get("out_format", "png"))
+    try:
+        startRender(job["input"], outfile, templates=templates, exporter=exporter, **overrides)()
+    except Exception:
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return outfile, tmp
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+
+    """
+    HTTP front end of the render server
+    """
+
+    def sendJson(self, status, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/status":
+            return self.sendJson(404, {"error": "unknown path %s" % self.path})
+        server = self.server
+        self.sendJson(200, {"pid": os.getpid(), "jobs": server.jobs, "uptime": time.time() - server.started,
+                            "templates": len(server.templates)})
+
+    def do_POST(self):
+        if self.path != "/render":
+            return self.sendJson(404, {"error": "unknown path %s" % self.path})
+        start = time.time()
+        tmp = None
+        try:
+            job = json.loads(self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8"))
+            outfile, tmp = renderRequest(job, self.server.templates, self.server.exporter)
+            body = None
+            if tmp or job.get("bytes"):
+                with open(outfile, "rb") as stream:
+                    body = stream.read()
+        except Exception:
+            return self.sendJson(500, {"error": traceback.format_exc()})
+        finally:
+            self.server.jobs += 1
+            if tmp:
+                shutil.rmtree(tmp, ignore_errors=True)
+
+        if body is None:
+            return self.sendJson(200, {"output": outfile, "seconds": time.time() - start})
+        self.send_response(200)
+        self.send_header("Content-Type", mimetypes.guess_type(outfile)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Render-Seconds", "%.6f" % (time.time() - start))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket peers have no (host, port) address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, fmt, *args)
+
+
+class ServerState(object):
+
+    """
+    State kept by the server between jobs
+    """
+
+    def setUp(self, verbose):
+        from nested_box_plots import DEFAULT_CONFIG
+        from output import Exporter
+
+        self.templates = OrderedDict()
+        # Kept between jobs rather than started for every list of formats
+        self.exporter = Exporter(DEFAULT_CONFIG["export_threads"])
+        self.jobs = 0
+        self.started = time.time()
+        self.verbose = verbose
+
+
+class TcpRenderServer(ServerState, HTTPServer):
+    pass
+
+
+class UnixRenderServer(ServerState, UnixStreamServer):
+    pass
+
+
+def makeServer(socket_path=None, port=DEFAULT_PORT, verbose=False):
+
+    """
+    Subroutine for a render server on a Unix socket, or on 127.0.0.1:port
+    """
+    if socket_path:
+        if os.path.exists(socket_path):
+            # Left over by a server that did not shut down cleanly
+            os.remove(socket_path)
+        server = UnixRenderServer(socket_path, RenderHandler)
+    else:
+        server = TcpRenderServer(("127.0.0.1", port), RenderHandler)
+    server.setUp(verbose)
+    return server
+
+
+def serve(socket_path=None, port=DEFAULT_PORT, verbose=False):
+
+    """
+    Warm up and serve render jobs until interrupted or terminated
+    """
+    # Clean up the socket on a plain kill as well
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    start = time.time()
+    warmUp()
+    server = makeServer(socket_path, port, verbose)
+    sys.stderr.write("render server ready on %s (warm-up %.1fs)\n"
+                     % (socket_path or "127.0.0.1:%d" % port, time.time() - start))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.exporter.close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+
+    """
+    HTTP connection over a Unix socket
+    """
+
+    def __init__(self, socket_path, timeout=None):
+        httplib.HTTPConnection.__init__(self, "localhost")
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def requestRender(infile, outfile=None, overrides=None, want_bytes=False, socket_path=None,
+                  port=DEFAULT_PORT, timeout=None):
+
+    """
+    Send a render job to a running server.
+    Returns the output path, or the image bytes when want_bytes or no outfile.
+    Raises RuntimeError with the server's traceback if the job failed.
+    """
+    if socket_path:
+        connection = UnixHTTPConnection(socket_path, timeout)
+    else:
+        connection = httplib.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    job = {"input": os.path.abspath(infile),
+           "output": os.path.abspath(outfile) if outfile else None,
+           "config": overrides or {},
+           "bytes": want_bytes}
+    try:
+        connection.request("POST", "/render", json.dumps(job), {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        body = response.read()
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise RuntimeError(json.loads(body.decode("utf-8"))["error"])
+    if want_bytes or not outfile:
+        return body
+    return json.loads(body.decode("utf-8"))["output"]
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Warm render service for nested box plots.")
+    commands = parser.add_subparsers(dest="command")
+    serve_parser = commands.add_parser("serve", help="run the server")
+    render_parser = commands.add_parser("render", help="send a job to a running server")
+    for sub in (serve_parser, render_parser):
+        sub.add_argument("--socket", help="Unix socket path (default: TCP on 127.0.0.1)")
+        sub.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("-v", "--verbose", action="store_true", help="log every request")
+    render_parser.add_argument("infile", help="input CSV")
+    render_parser.add_argument("outfile", nargs="?", help="output plot (omit to receive the image on stdout)")
+    render_parser.add_argument("-f", "--format", help="output format when no outfile is given")
+    render_parser.add_argument("--bytes", action="store_true", help="write the image to stdout")
+    render_parser.add_argument("--set", dest="overrides", action="append", metavar="KEY=VALUE",
+                               help="override a configurable of nested_box_plots.DEFAULT_CONFIG (value as JSON)")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(args.socket, args.port, args.verbose)
+        return 0
+    if args.command != "render":
+        parser.error("choose a command: serve or render")
+
+    overrides = parseOverrides(args.overrides)
+    if args.format:
+        overrides["out_format"] = args.format
+    try:
+        result = requestRender(args.infile, args.outfile, overrides, args.bytes, args.socket, args.port)
+    except RuntimeError as error:
+        sys.stderr.write("%s\n" % error)
+        return 1
+    if args.bytes or not args.outfile:
+        getattr(sys.stdout, "buffer", sys.stdout).write(result)
+    else:
+        sys.stderr.write("%s\n" % result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
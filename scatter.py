@@ -0,0 +1,142 @@
+"""
+Scatter layer for the nested box plots.
+
+Draws the points of all individual boxes as one batched scatter
+(one PathCollection with a per-point colour array) instead of one
+ax.scatter call per animal.
+
+Boxes holding more points than a configurable threshold switch to a
+level-of-detail representation:
+
+    "subsample"  a random subset of threshold points, optionally jittered
+    "density"    a binned density strip, drawn for all such boxes as one
+                 PolyCollection of rectangles whose opacity follows the
+                 bin counts
+"""
+
+
+import numpy as np
+from matplotlib.collections import PolyCollection
+from matplotlib.colors import to_rgba_array
+
+from grouping import DEFAULT_SPEC, iterBoxes
+
+
+def scatterBoxes(tree, positions, spec=DEFAULT_SPEC):
+
+    """
+    Subroutine for the individual (non "All") boxes and their x positions
+    """
+    return [(pos, box) for pos, (path, box) in zip(positions, iterBoxes(tree))
+            if path[-1] != spec["all_label"]]
+
+
+def batchPoints(boxes, alpha=1., lod_threshold=None, jitter=0., rng=None):
+
+    """
+    Concatenate the points of the boxes into x, y and RGBA arrays.
+
+    Boxes with more than lod_threshold points are subsampled to
+    lod_threshold points. jitter spreads the points horizontally by up
+    to +/- jitter * box width.
+    """
+    rng = rng if rng is not None else np.random.RandomState(0)
+    ys = []
+    counts = []
+    for pos, box in boxes:
+        y = np.asarray(box["data"])
+        if lod_threshold is not None and len(y) > lod_threshold:
+            y = y[np.sort(rng.choice(len(y), lod_threshold, replace=False))]
+        ys.append(y)
+        counts.append(len(y))
+
+    counts = np.array(counts, dtype=np.int64)
+    y = np.concatenate(ys) if ys else np.empty(0)
+    x = np.repeat([pos for pos, box in boxes], counts).astype(np.float64)
+    if jitter:
+        widths = np.repeat([box["width"] for pos, box in boxes], counts)
+        x += rng.uniform(-jitter, jitter, len(x)) * widths
+    colors = to_rgba_array([box["color"] for pos, box in boxes]) if boxes else np.empty((0, 4))
+    colors[:, 3] *= alpha
+    return x, y, np.repeat(colors, counts, axis=0)
+
+
+def densityStrips(boxes, alpha=1., bins=50, strip_width=1.):
+
+    """
+    Build the rectangles of binned density strips for the given boxes.
+
+    All boxes share one set of bin edges; each strip is strip_width
+    times the box width wide and each bin's opacity is its count
+    relative to the fullest bin of the same box.
+    Returns (vertices, RGBA colours) for a PolyCollection.
+    """
+    counts = np.array([len(box["data"]) for pos, box in boxes], dtype=np.int64)
+    y = np.concatenate([np.asarray(box["data"]) for pos, box in boxes])
+    edges = np.linspace(y.min(), y.max() if y.max() > y.min() else y.min() + 1., bins + 1)
+    box_idx = np.repeat(np.arange(len(boxes)), counts)
+    bin_idx = np.clip(np.searchsorted(edges, y, side="right") - 1, 0, bins - 1)
+    hist = np.bincount(box_idx * bins + bin_idx, minlength=len(boxes) * bins).reshape(len(boxes), bins)
+
+    filled_box, filled_bin = np.nonzero(hist)
+    centres = np.array([pos for pos, box in boxes], dtype=np.float64)[filled_box]
+    half = 0.5 * strip_width * np.array([box["width"] for pos, box in boxes])[filled_box]
+    lo, hi = edges[filled_bin], edges[filled_bin + 1]
+    verts = np.stack([np.column_stack([centres - half, lo]),
+                      np.column_stack([centres - half, hi]),
+                      np.column_stack([centres + half, hi]),
+                      np.column_stack([centres + half, lo])], axis=1)
+
+    colors = to_rgba_array([box["color"] for pos, box in boxes])[filled_box]
+    colors[:, 3] = alpha * hist[filled_box, filled_bin] / hist.max(axis=1)[filled_box]
+    return verts, colors
+
+
+def scatterLayers(tree, positions, spec=DEFAULT_SPEC, alpha=1., lod_threshold=None,
+                  lod_mode="subsample", jitter=0., bins=50, seed=0):
+
+    """
+    Compute the scatter layer of a grouped tree without drawing it.
+
+    Returns (x, y, colors, strips) where strips is the (vertices,
+    colours) pair of the density strips, or None when there are none.
+    """
+    rng = np.random.RandomState(seed)
+    boxes = scatterBoxes(tree, positions, spec)
+    dense = []
+    if lod_threshold is not None and lod_mode == "density":
+        dense = [b for b in boxes if len(b[1]["data"]) > lod_threshold]
+        boxes = [b for b in boxes if len(b[1]["data"]) <= lod_threshold]
+        lod_threshold = None
+
+    x, y, colors = batchPoints(boxes, alpha=alpha, lod_threshold=lod_threshold, jitter=jitter, rng=rng)
+    strips = densityStrips(dense, alpha=alpha, bins=bins) if dense else None
+    return x, y, colors, strips
+
+
+def drawScatter(ax, tree, positions, spec=DEFAULT_SPEC, size=22, alpha=1.,
+                lod_threshold=None, lod_mode="subsample", jitter=0., bins=50, seed=0):
+
+    """
+    Draw the scatter layer of a grouped tree onto ax.
+
+    Returns the list of artists added (one PathCollection, plus one
+    PolyCollection when density strips are drawn).
+    """
+    x, y, colors, strips = scatterLayers(tree, positions, spec, alpha=alpha, lod_threshold=lod_threshold,
+                                         lod_mode=lod_mode, jitter=jitter, bins=bins, seed=seed)
+    artists = [ax.scatter(x, y, c=colors, edgecolor="None", s=size)]
+    if strips is not None:
+        artists.append(addStrips(ax, strips))
+    return artists
+
+
+def addStrips(ax, strips):
+
+    """
+    Subroutine for adding density strips to ax as one PolyCollection
+    """
+    verts, colors = strips
+    collection = PolyCollection(verts, facecolors=colors, edgecolors="none")
+    ax.add_collection(collection)
+    return collection
@@ -0,0 +1,206 @@
+"""
+Sharded ingest for the nested box plots.
+
+Input that arrives as one CSV per animal or imaging session is read
+from a directory or glob of shards, without concatenating the files
+first. A pool of worker processes parses the shards concurrently (in
+turn within batch_render.py workers, see shard_workers) and reduces
+each one to per-group partials: the sorted values of every (Channel,
+Geno, Animal) group (see grouping.groupMetrics), or in streaming mode
+its quantile sketch and scatter sample (see streaming.py). The parent
+merges the partials of every group across shards, so the tree and its
+"All" boxes come out as from a single file.
+
+Every shard must have the level columns and the same value columns.
+"""
+
+
+import glob
+import multiprocessing
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from grouping import DEFAULT_SPEC, groupMetrics, orderPaths, valueColumns
+
+
+def isSharded(source):
+
+    """
+    Whether an input is a directory or glob pattern of CSV shards rather
+    than one file; an existing file is never a pattern, even with [, * or ?
+    in its name
+    """
+    if os.path.isfile(source):
+        return False
+    return os.path.isdir(source) or glob.has_magic(source)
+
+
+def shardFiles(source):
+
+    """
+    Subroutine for the CSV shards of a directory or glob pattern, in a stable order
+    """
+    pattern = os.path.join(source, "*.csv") if os.path.isdir(source) else source
+    paths = sorted(glob.glob(pattern))
+    if not paths:
+        raise ValueError("no CSV shards match %s" % pattern)
+    return paths
+
+
+def mapShards(function, tasks, workers=None):
+
+    """
+    Subroutine for the results of function on every task, in order and
+    as soon as they are ready, from a pool of worker processes (one per
+    core for None), or from this process for one worker and in daemonic
+    processes (such as multiprocessing.Pool workers), which may not
+    start processes of their own
+    """
+    workers = workers or multiprocessing.cpu_count()
+    if workers <= 1 or len(tasks) <= 1 or multiprocessing.current_process().daemon:
+        for task in tasks:
+            yield function(task)
+        return
+    pool = multiprocessing.Pool(min(workers, len(tasks)))
+    try:
+        for result in pool.imap(function, tasks):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def shardColumns(task):
+
+    """
+    Worker: parse one shard into its grouped value columns (see
+    grouping.groupMetrics); with a spill directory, the columns are
+    written there as .npy files and their paths returned instead
+    """
+    import pandas as pd
+
+    n, path, metrics, spec, dtype, spill_dir = task
+    read_data = pd.read_csv(path)
+    columns, offsets, leaf_keys = groupMetrics(read_data, valueColumns(read_data, metrics, spec), spec, dtype)
+    if spill_dir is not None:
+        files = OrderedDict()
+        for i, (name, values) in enumerate(columns.items()):
+            files[name] = os.path.join(spill_dir, "%d_%d.npy" % (n, i))
+            np.save(files[name], values)
+        columns = files
+    return columns, offsets, leaf_keys
+
+
+def spilledColumns(partials):
+
+    """
+    Subroutine for the shards of shardColumns with their spilled columns
+    memory-mapped, as they arrive
+    """
+    for files, offsets, leaf_keys in partials:
+        yield OrderedDict((name, np.load(path, mmap_mode="r")) for name, path in files.items()), offsets, leaf_keys
+
+
+def mergeColumns(partials, spec=DEFAULT_SPEC):
+
+    """
+    Merge the grouped value columns of several shards into grouped
+    columns of all the data, as grouping.groupMetrics returns them for
+    the concatenated shards.
+
+    partials may be an iterator, consumed as the shards are parsed. Once
+    the sizes of all groups are known, the runs of the shards are copied
+    into the merged columns one shard at a time, each shard being
+    dropped once copied; with memory-mapped shards (see shardedColumns)
+    memory then stays near the size of the data rather than twice it.
+    A group found in several shards is then sorted with a stable sort,
+    which merges the presorted runs of the shards.
+    """
+    shards = []
+    counts = {}
+    for columns, offsets, leaf_keys in partials:
+        if shards and list(columns.keys()) != list(shards[0][0].keys()):
+            raise ValueError("the shards have different value columns: %s and %s"
+                             % (", ".join(map(str, shards[0][0].keys())), ", ".join(map(str, columns.keys()))))
+        for i, key in enumerate(leaf_keys):
+            counts.setdefault(key, []).append(offsets[i + 1] - offsets[i])
+        shards.append((columns, offsets, leaf_keys))
+
+    names = list(shards[0][0].keys())
+    leaf_keys = orderPaths(counts.keys(), spec)
+    offsets = np.r_[0, np.cumsum([sum(counts[key]) for key in leaf_keys])].astype(np.int64)
+    merged = OrderedDict((name, np.empty(offsets[-1], dtype=np.result_type(*[s[0][name] for s in shards])))
+                         for name in names)
+
+    # Next free position of every group in the merged columns
+    position = dict((key, offsets[i]) for i, key in enumerate(leaf_keys))
+    for n in range(len(shards)):
+        columns, starts, keys = shards[n]
+        shards[n] = None
+        for i, key in enumerate(keys):
+            size = starts[i + 1] - starts[i]
+            for name in names:
+                merged[name][position[key]:position[key] + size] = columns[name][starts[i]:starts[i + 1]]
+            position[key] += size
+        columns = None
+
+    for i, key in enumerate(leaf_keys):
+        if len(counts[key]) > 1:
+            for values in merged.values():
+                values[offsets[i]:offsets[i + 1]].sort(kind="stable")
+    return merged, offsets, leaf_keys
+
+
+def shardedColumns(source, spec=DEFAULT_SPEC, metrics=None, dtype=None, workers=None):
+
+    """
+    Grouped value columns (see grouping.groupMetrics and
+    grouping.valueColumns) of all the shards of source, parsed in
+    parallel
+
+    The workers spill the grouped columns of their shard to a temporary
+    directory (see tempfile; TMPDIR chooses where), from which they are
+    merged memory-mapped: the parent does not hold the parsed shards on
+    its heap next to the merged columns.
+    """
+    spill_dir = tempfile.mkdtemp(prefix="nested_box_shards_")
+    try:
+        tasks = [(n, path, metrics, spec, dtype, spill_dir) for n, path in enumerate(shardFiles(source))]
+        return mergeColumns(spilledColumns(mapShards(shardColumns, tasks, workers)), spec)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+def shardSummaries(task):
+
+    """
+    Worker: read one shard chunk by chunk into per-group summaries (see streaming.streamSummaries)
+    """
+    from streaming import streamSummaries
+
+    path, spec, chunk_rows, rank_error, sample_size, seed = task
+    return streamSummaries(path, spec=spec, chunk_rows=chunk_rows, rank_error=rank_error,
+                           sample_size=sample_size, seed=seed)
+
+
+def shardedSummaries(source, spec=DEFAULT_SPEC, chunk_rows=1000000, rank_error=0.01, sample_size=2000,
+                     seed=None, workers=None):
+
+    """
+    Per-group (sketch, sample) summaries of all the shards of source,
+    read in parallel and merged group by group
+    """
+    tasks = [(path, spec, chunk_rows, rank_error, sample_size, seed) for path in shardFiles(source)]
+    summaries = {}
+    for partial in mapShards(shardSummaries, tasks, workers):
+        for key, (sketch, sample) in partial.items():
+            if key not in summaries:
+                summaries[key] = (sketch, sample)
+            else:
+                summaries[key][0].merge(sketch)
+                summaries[key][1].merge(sample)
+    return summaries
@@ -0,0 +1,170 @@
+"""
+Mergeable summaries for out-of-core box plots.
+
+QuantileSketch is a KLL-style quantile sketch: a stack of compactors
+where level h holds items of weight 2**h. When a level overflows it is
+sorted and every other item (random offset) is promoted to the next
+level, so the memory used stays O(k log(n / k)) however many values
+are pushed in. Two sketches are merged by stacking their levels and
+compacting again, which is how the "All" boxes are obtained from the
+sketches of their children.
+
+PrioritySample keeps a bounded uniform sample of the values (the m
+values with the smallest random priorities), used for the scatter
+layer. It is mergeable in the same way.
+"""
+
+
+import math
+
+import numpy as np
+
+
+def rankError(k):
+
+    """
+    Subroutine for the approximate normalized rank error of a sketch of size k
+    (single quantile, ~99% confidence, empirical KLL constants)
+    """
+    return 2.296 / k ** 0.9723
+
+
+def sizeForRankError(rank_error):
+
+    """
+    Subroutine for the smallest sketch size k meeting a rank error bound
+    """
+    return max(8, int(math.ceil((2.296 / rank_error) ** (1. / 0.9723))))
+
+
+class QuantileSketch(object):
+
+    """
+    Mergeable streaming quantile sketch with exact count, sum, min and max
+    """
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.rng = np.random.RandomState(seed)
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self.total = 0.
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def rank_error(self):
+        return rankError(self.k)
+
+    def capacity(self, h):
+        depth = len(self.levels) - h - 1
+        return max(2, int(math.ceil(self.k * (2. / 3.) ** depth)))
+
+    def update(self, values):
+
+        """
+        Push an array of values into the sketch
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if not len(values):
+            return
+        self.count += len(values)
+        self.total += values.sum()
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.compress()
+
+    def merge(self, other):
+
+        """
+        Fold another sketch into this one
+        """
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, items in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], items])
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress()
+        return self
+
+    def compress(self):
+
+        """
+        Compact overflowing levels until every level is within capacity
+        """
+        compacted = True
+        while compacted:
+            compacted = False
+            for h in range(len(self.levels)):
+                items = self.levels[h]
+                if len(items) <= self.capacity(h):
+                    continue
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                odd = len(items) % 2
+                self.levels[h] = items[:odd]
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1],
+                                                     items[odd + self.rng.randint(2)::2]])
+                compacted = True
+
+    def weightedItems(self):
+
+        """
+        Subroutine for the retained items, sorted, with their weights
+        """
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(l), 2. ** h) for h, l in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        return items[order], weights[order]
+
+    def quantile(self, q):
+
+        """
+        Approximate q-th quantile(s), q in [0, 1]; 0 and 1 give the exact min and max
+        """
+        q = np.asarray(q, dtype=np.float64)
+        if not self.count:
+            return np.full(q.shape, np.nan)
+        items, weights = self.weightedItems()
+        cum = np.cumsum(weights)
+        idx = np.minimum(np.searchsorted(cum, q * cum[-1], side="left"), len(items) - 1)
+        result = np.where(q <= 0, self.min, np.where(q >= 1, self.max, items[idx]))
+        return result if result.ndim else float(result)
+
+    def nbytes(self):
+        return sum(l.nbytes for l in self.levels)
+
+
+class PrioritySample(object):
+
+    """
+    Mergeable bounded uniform sample: the size values with the smallest random priorities
+    """
+
+    def __init__(self, size=2000, seed=None):
+        self.size = size
+        self.rng = np.random.RandomState(seed)
+        self.values = np.empty(0)
+        self.priorities = np.empty(0)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        self.keep(np.concatenate([self.values, values]),
+                  np.concatenate([self.priorities, self.rng.random_sample(len(values))]))
+
+    def merge(self, other):
+        self.keep(np.concatenate([self.values, other.values]),
+                  np.concatenate([self.priorities, other.priorities]))
+        return self
+
+    def keep(self, values, priorities):
+        if len(values) > self.size:
+            idx = np.argpartition(priorities, self.size)[:self.size]
+            values, priorities = values[idx], priorities[idx]
+        self.values = values
+        self.priorities = priorities
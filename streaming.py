@@ -0,0 +1,80 @@
+"""
+Out-of-core ingest for the nested box plots.
+
+Reads the input CSV in fixed-size chunks and keeps, per
+(Channel, Geno, Animal) group, a mergeable quantile sketch and a
+bounded scatter sample (see sketches.py). The "All" boxes are
+obtained by merging the sketches of their children, so memory stays
+bounded by the chunk size and the number of groups, not the file size.
+
+The result is a tree of the same shape as grouping.groupData, where
+each box carries a "sketch" and its "data" is the scatter sample.
+"""
+
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from grouping import DEFAULT_SPEC, buildTree, getValueColumn, orderPaths
+from sketches import PrioritySample, QuantileSketch, sizeForRankError
+
+
+def streamSummaries(path, data_name=None, spec=DEFAULT_SPEC, chunk_rows=1000000,
+                    rank_error=0.01, sample_size=2000, seed=None):
+
+    """
+    Read a CSV chunk by chunk into per-group (sketch, sample) summaries,
+    keyed by the tuple of level values
+    """
+    if data_name is None:
+        data_name = getValueColumn(pd.read_csv(path, nrows=0), spec)
+    k = sizeForRankError(rank_error)
+
+    summaries = {}
+    for chunk in pd.read_csv(path, usecols=list(spec["levels"]) + [data_name], chunksize=chunk_rows):
+        for key, values in chunk.groupby(spec["levels"], sort=False)[data_name]:
+            if key not in summaries:
+                summaries[key] = (QuantileSketch(k, seed=seed), PrioritySample(sample_size, seed=seed))
+            sketch, sample = summaries[key]
+            values = values.to_numpy()
+            sketch.update(values)
+            sample.update(values)
+    return summaries
+
+
+def summaryTree(summaries, spec=DEFAULT_SPEC):
+
+    """
+    Arrange per-group summaries into the nested box tree,
+    merging the children of each parent into its "All" box
+    """
+    parents = OrderedDict()
+    for key in orderPaths(summaries.keys(), spec):
+        sketch, sample = summaries[key]
+        parents.setdefault(key[:-1], []).append((key[-1], sketch, sample))
+
+    tree_parents = OrderedDict()
+    for parent, leaves in parents.items():
+        all_sketch = QuantileSketch(leaves[0][1].k)
+        all_sample = PrioritySample(leaves[0][2].size)
+        children = []
+        for value, sketch, sample in leaves:
+            all_sketch.merge(sketch)
+            all_sample.merge(sample)
+            children.append((value, {"sketch": sketch, "data": np.sort(sample.values)}))
+        tree_parents[parent] = (children, {"sketch": all_sketch, "data": np.sort(all_sample.values)})
+
+    return buildTree(tree_parents, spec)
+
+
+def streamData(path, data_name=None, spec=DEFAULT_SPEC, chunk_rows=1000000,
+               rank_error=0.01, sample_size=2000, seed=None):
+
+    """
+    Streaming counterpart of grouping.groupData for CSVs that do not fit in memory
+    """
+    summaries = streamSummaries(path, data_name, spec, chunk_rows=chunk_rows,
+                                rank_error=rank_error, sample_size=sample_size, seed=seed)
+    return summaryTree(summaries, spec)
@@ -0,0 +1,241 @@
+"""
+Reusable figure template for the nested box plots.
+
+FigureTemplate builds the figure once for a given box layout: axes,
+fonts, tick positions and labels, the dotted channel separators, the
+box collections (see box_artists.py) and the scatter collection.
+Rendering another dataset with the same layout (same boxes in the same
+order) only pushes the new statistics and points into the existing
+artists instead of rebuilding and restyling all of them.
+"""
+
+
+import math
+
+import matplotlib as mpl
+import matplotlib.pyplot as plt
+import numpy as np
+
+from grouping import iterBoxes
+from box_stats import metricStats, statsRange, treeStats
+from bootstrap import bootstrapStats
+from box_artists import boxPoints, boxSegments, drawBoxes, moveBoxes
+from scatter import addStrips, scatterLayers
+from output import outputFiles, rasterizeArtists, savePlot
+from profiling import NULL_PROFILER
+
+
+def figureStats(mega_data_dict, config):
+
+    """
+    Subroutine for the box statistics of a tree, with bootstrap
+    intervals of the medians when the configuration asks for them
+    """
+    return bootstrapIntervals(mega_data_dict, treeStats(mega_data_dict, config["spec"], whis=config["whis"]), config)
+
+
+def metricsStats(trees, config):
+
+    """
+    Subroutine for the box statistics of the trees of several value
+    columns (see grouping.metricsData), computed in one pass
+    """
+    stats = metricStats(trees, config["spec"], whis=config["whis"])
+    for name, tree in trees.items():
+        bootstrapIntervals(tree, stats[name], config)
+    return stats
+
+
+def bootstrapIntervals(mega_data_dict, stats, config):
+
+    """
+    Subroutine for replacing the median intervals of the statistics of a
+    tree with bootstrap intervals, when the configuration asks for them
+    """
+    if config["bootstrap"]:
+        bootstrapStats(mega_data_dict, stats, config["spec"], n_boot=config["bootstrap"],
+                       level=config["bootstrap_level"], hierarchical=config["bootstrap_hierarchical"],
+                       seed=config["bootstrap_seed"], workers=config["bootstrap_workers"])
+    return stats
+
+
+def layoutPaths(mega_data_dict):
+
+    """
+    Subroutine for the box paths that define a layout
+    """
+    return tuple(path for path, box in iterBoxes(mega_data_dict))
+
+
+class FigureTemplate(object):
+
+    """
+    Figure skeleton for one box layout, updated in place with new data
+    """
+
+    def __init__(self, mega_data_dict, config, positions, profiler=NULL_PROFILER, stats=None, ax=None):
+
+        """
+        Build the figure for the layout of mega_data_dict; positions is the
+        (box, tick, separator) x positions triple of layout.boxLayout.
+        The stages are recorded by profiler (see profiling.py), which may
+        be replaced between renders.
+
+        stats are the box statistics when already computed (see
+        metricsStats), and ax the axes to draw into when the plot is one
+        panel of a larger figure.
+        """
+        self.config = config
+        self.profiler = profiler
+        self.spec = config["spec"]
+        self.paths = layoutPaths(mega_data_dict)
+        boxes = [box for path, box in iterBoxes(mega_data_dict)]
+        self.widths = [box["width"] for box in boxes]
+        colors = [box["color"] for box in boxes]
+        self.xidx, xtick_positions, self.vertical_lines_positions = positions
+
+        if stats is None:
+            with profiler.stage("stats", boxes=len(boxes)):
+                stats = figureStats(mega_data_dict, config)
+        self.stats = stats
+
+        with profiler.stage("boxplot", boxes=len(boxes)):
+            if ax is None:
+                self.fig = plt.figure(figsize=config["figsize"])
+                self.ax = self.fig.add_subplot(111)
+            else:
+                self.fig, self.ax = ax.figure, ax
+            segments = boxSegments(self.stats, self.xidx, self.widths, notch=config["notch"])
+            self.boxes = drawBoxes(self.ax, segments, colors, self.xidx, intervals=config["ci_errorbars"])
+            self.box_points = boxPoints(segments)
+            profiler.count(artists=len(self.boxes))
+
+        self.scatter = self.ax.scatter([], [], edgecolor="None", s=config["scatter_size"])
+        self.strips = None
+        self.vlines = self.ax.vlines(self.vertical_lines_positions, 0, 1, linestyle='dotted')
+        if config["rasterize_scatter"]:
+            rasterizeArtists([self.scatter])
+
+        mpl.rcParams['font.sans-serif']='Arial'
+        self.ax.set_ylabel(config["y_axis_name"], fontweight=config["ylabel_fontweight"],
+                           fontsize=config["ylabel_fontsize"])
+        self.ax.yaxis.set_tick_params(labelsize=config["ytick_fontsize"])
+        for t in self.ax.get_yticklabels():
+            t.set_weight(config["ytick_fontweight"])
+        self.ax.set_xlabel("")
+        self.ax.set_xticks(xtick_positions)
+        self.ax.set_xticklabels(list(mega_data_dict.keys()), fontweight=config["xtick_fontweight"],
+                                fontsize=config["xtick_fontsize"])
+
+        self.updateData(mega_data_dict)
+
+    def matches(self, mega_data_dict):
+
+        """
+        Whether a tree has the layout this template was built for
+        """
+        return layoutPaths(mega_data_dict) == self.paths
+
+    def update(self, mega_data_dict, stats=None):
+
+        """
+        Push the data of a tree with the same layout into the artists,
+        with its box statistics when already computed.
+        Returns the new box statistics.
+        """
+        if not self.matches(mega_data_dict):
+            raise ValueError("the boxes of the data do not match the layout of the template")
+        if stats is None:
+            with self.profiler.stage("stats", boxes=len(self.paths)):
+                stats = figureStats(mega_data_dict, self.config)
+        self.stats = stats
+        with self.profiler.stage("boxplot", boxes=len(self.paths)):
+            self.updateBoxes()
+        self.updateData(mega_data_dict)
+        return self.stats
+
+    def updateSome(self, mega_data_dict, changed_stats):
+
+        """
+        Push new statistics for some boxes only, given as a dict from
+        box index to statistics, and refresh the data layer of the tree
+        """
+        for idx, stats in changed_stats.items():
+            self.stats[idx] = stats
+        with self.profiler.stage("boxplot", boxes=len(changed_stats)):
+            self.updateBoxes()
+        self.updateData(mega_data_dict)
+        return self.stats
+
+    def updateBoxes(self):
+
+        """
+        Subroutine for moving the box collections to the current statistics;
+        the segments of all boxes are recomputed at once
+        """
+        segments = boxSegments(self.stats, self.xidx, self.widths, notch=self.config["notch"])
+        moveBoxes(self.boxes, segments)
+        self.box_points = boxPoints(segments)
+
+    def updateData(self, mega_data_dict):
+
+        """
+        Subroutine for refreshing the scatter, the channel separators and the y limits
+        """
+        config = self.config
+        with self.profiler.stage("scatter"):
+            x, y, colors, strips = scatterLayers(mega_data_dict, self.xidx, self.spec,
+                                                 alpha=config["transparency_of_scatter"],
+                                                 lod_threshold=config["lod_threshold"], lod_mode=config["lod_mode"],
+                                                 jitter=config["scatter_jitter"], bins=config["density_bins"])
+            points = np.column_stack([x, y])
+            self.scatter.set_offsets(points)
+            self.scatter.set_facecolors(colors)
+            if self.strips is not None:
+                self.strips.remove()
+                self.strips = None
+            if strips is not None:
+                self.strips = addStrips(self.ax, strips)
+                if config["rasterize_scatter"]:
+                    rasterizeArtists([self.strips])
+            self.profiler.count(points=len(points), strips=0 if strips is None else len(strips[0]))
+
+        yrange = config["yrange"]
+        if not yrange or len(yrange) != 2:
+            ymin, ymax = statsRange(self.stats)
+            ymin, ymax = min(0, math.floor(ymin)), math.ceil(ymax)
+        else:
+            ymin, ymax = yrange
+        self.vlines.set_segments([[(x_, ymin), (x_, ymax)] for x_ in self.vertical_lines_positions])
+
+        # Recompute the data limits from the moved artists
+        self.ax.relim()
+        self.ax.update_datalim(self.box_points)
+        self.ax.update_datalim(points)
+        self.ax.update_datalim([(x_, y_) for x_ in self.vertical_lines_positions for y_ in (ymin, ymax)])
+        if strips is not None:
+            self.ax.update_datalim(strips[0].reshape(-1, 2))
+        self.ax.autoscale_view()
+
+    def save(self, outfile, exporter=None):
+
+        """
+        Save the current state of the figure, in every format of a list
+        of formats as <outfile stem>.<format>; with an exporter (see
+        output.Exporter), the figure is drawn once for all raster formats
+        and the files are finished in the background
+        """
+        config = self.config
+        outfiles = outputFiles(outfile, config["out_format"])
+        with self.profiler.stage("save", format=",".join(f for f, path in outfiles), dpi=config["dpi"]):
+            if exporter is not None:
+                exporter.save(self.fig, outfiles, dpi=config["dpi"], raster_dpi=config["raster_dpi"],
+                              max_pixels=config["max_pixels"], strip_rows=config["strip_rows"])
+            else:
+                for out_format, path in outfiles:
+                    savePlot(self.fig, path, out_format, dpi=config["dpi"], raster_dpi=config["raster_dpi"],
+                             max_pixels=config["max_pixels"], strip_rows=config["strip_rows"])
+            self.profiler.count(artists=len(self.fig.findobj()))
+
+    def close(self):
+        plt.close(self.fig)